@@ -0,0 +1,62 @@
+"""Check that a simulation resumed from a checkpoint
+gives the same trajectories as an uninterrupted one.
+
+The labyrinth scenario is run for 2*T seconds, then
+again for T seconds saving a checkpoint, and resumed
+from that checkpoint up to 2*T seconds. The script
+exits with status 1 if both trajectories differ.
+Pass "MockRingNetwork" as argument to check that
+network instead of MockNetwork.
+"""
+from marabunta import Scenario
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+here = os.path.dirname(os.path.abspath(__file__))
+labyrinth = os.path.join(here, "..", "labyrinth")
+network = sys.argv[1] if len(sys.argv) > 1 else "MockNetwork"
+T = 10.
+dt = 0.5
+
+with open(os.path.join(labyrinth, "labyrinth.json"), 'r') as f:
+    data = json.load(f)
+data["map"]["file"] = os.path.join(labyrinth, data["map"]["file"])
+data["network"] = {"class": network}
+data["robots"]["count"] = 10
+data["dt"] = dt
+
+
+def run(name, duration, resume=False):
+    """Run the scenario in *workdir* up to *duration*
+    recording the trajectory in *name*.dat.
+    Return the lines of the trajectory.
+    """
+    settings = dict(data)
+    settings["duration"] = duration
+    settings["output"] = {"trajectory": name + ".dat",
+                          "checkpoint": name + ".ckpt",
+                          "checkpoint_every": int(round(T / dt))}
+    Scenario(settings, workdir).run(resume)
+    with open(os.path.join(workdir, name + ".dat"), 'r') as f:
+        return f.readlines()
+
+workdir = tempfile.mkdtemp(prefix="resume_")
+try:
+    full = run("full", 2 * T)
+    run("part", T)
+    resumed = run("part", 2 * T, resume=True)
+finally:
+    shutil.rmtree(workdir, True)
+
+if full == resumed:
+    print("resumed run equals full run ({:} records)".format(len(full)))
+else:
+    diff = [(a, b) for a, b in zip(full, resumed) if a != b]
+    print("resumed run differs from full run in {:} records, first:".format(
+        len(diff) + abs(len(full) - len(resumed))))
+    if diff:
+        print(diff[0][0] + diff[0][1])
+    sys.exit(1)
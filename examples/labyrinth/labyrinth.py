@@ -1,10 +1,7 @@
-from marabunta import BaseRobot, MockBody, MockNetwork
+from marabunta import BaseRobot, MockBody, MockNetwork, Map2D
+from marabunta import RenderProcess
 import random
 
-# for visualization
-import numpy as np
-import pylab as pl
-
 class myRobot(BaseRobot):
     def __init__(self, setting):
         body = MockBody(setting.get("position") ,setting.get("heading"))
@@ -15,18 +12,16 @@ class myRobot(BaseRobot):
     def spread_target(self):
         neis = self.get_agents().values()
         pos = self.body.get_position()
-        # Get both neighbors and obstacles, in relative coordinates
-        obstacles = self.body.obstacle_coordinates()
-        points = [ [nei[0]-pos[0], nei[1]-pos[1]] for nei in neis] + obstacles
-        if points:
-            target = [0.,0.]
-            for p in points:
-                d2 = p[0]**2 + p[1]**2
+        # Obstacle repulsion is looked up in the precomputed field
+        target = self.body.obstacle_repulsion()
+        points = [ [nei[0]-pos[0], nei[1]-pos[1]] for nei in neis]
+        for p in points:
+            d2 = p[0]**2 + p[1]**2
+            if d2>0:
                 weight = (1.0/d2 )**1.5
-                if d2>0:
-                    target[0] -= p[0]*weight
-                    target[1] -= p[1]*weight
-        else:
+                target[0] -= p[0]*weight
+                target[1] -= p[1]*weight
+        if not points and target[0]==0. and target[1]==0.:
             target= None
         return target
 
@@ -57,7 +52,6 @@ dt=0.5
 total_time = 100
 speed = 0.4
 map_file = "map_points.dat"
-obstacles = np.loadtxt(map_file)
 
 
 #--------------------------------------------------------
@@ -73,25 +67,21 @@ def random_position(x0, y0, R0):
     y = y0 + y*R0
     return [x,y]
 
-def plot(robots, obstacles):
-    """Plots the current configuration of robots."""
-    xs = [robot.body.get_position()[0] for robot in robots]
-    ys = [robot.body.get_position()[1] for robot in robots]
-    pl.plot(obstacles[:,0],obstacles[:,1],'gs',markersize=20.)
-    pl.plot(xs,ys,'ro')
-    pl.show(block=False)
-    pl.pause(0.0000001)
-    pl.close()
-    return
 #-----------------------------------------------------
 
 settings = [ {"ID":"R%02i"%i, "position":random_position(1.5,0.5,0.2), "heading":0.} for i in range(num_robots)]
 
 robots = [ myRobot(s) for s in settings]
 
-[robot.body.load_obstacles(map_file) for robot in robots]
+# One map, with the repulsion field precomputed, shared by all robots
+shared_map = Map2D(map_file, 0.5, field_resolution=0.05)
+[robot.body.load_obstacles(shared_map) for robot in robots]
 [robot.turn_on() for robot in robots]
 
+# The plot is drawn in a separate process. Pass output="labyrinth.mp4"
+# (or "frame_%04d.png") and show=False to save it instead.
+renderer = RenderProcess(shared_map)
+
 try:
     [robot.broadcast_state() for robot in robots]
 
@@ -100,6 +90,9 @@ try:
         for robot in robots:
             if robot.is_working():
                 robot.update(dt, speed)
-        plot(robots, obstacles)
+        renderer.draw([(robot.body.get_position()[0],
+                        robot.body.get_position()[1],
+                        robot.body.get_heading()) for robot in robots], it*dt)
 finally:
     [robot.turn_off() for robot in robots]
+    renderer.close()
@@ -0,0 +1,199 @@
+from time import time
+import threading
+import heapq
+from Map import SpatialHash
+
+
+class AgentSnapshot(dict):
+    """Read-only dictionary { ID: (x, y, heading) } with
+    the state of the agents at a given *version* of
+    the table it was taken from. Since it is never
+    modified, it can be iterated safely while the
+    network keeps receiving data.
+    A *version* of None means that it is unknown
+    whether the data changed since the last snapshot.
+    """
+    def __init__(self, data=(), version=None):
+        dict.__init__(self, data)
+        self.version = version
+        return
+
+    def read_only(self, *args, **kws):
+        raise TypeError("AgentSnapshot is read-only")
+
+    __setitem__ = __delitem__ = read_only
+    clear = pop = popitem = setdefault = update = read_only
+
+    def __reduce__(self):
+        return (AgentSnapshot, (dict(self), self.version))
+
+
+class AgentTable(dict):
+    """Dictionary of the form { ID: (x, y, heading) }
+    with the last state received from each agent.
+    For each entry it also stores the time the state
+    was sent (according to the sender) in self.sent
+    and the time it was received in self.received.
+    The sending times are also kept in a min-heap so
+    that the agents whose last state is older than
+    a given age can be evicted in O(log n) each,
+    without scanning the whole table.
+    If *expiration_time* is given, it is used as the
+    default maximum age when pruning.
+    Since the table is itself the dictionary of states,
+    it can be returned by get_agents_state() as is.
+    Every change in the table increases self.version,
+    and snapshot() returns a read-only copy of the
+    table that is only rebuilt when the version changed.
+    The positions are also stored in a SpatialHash with
+    cells of side *cell_size* to find the agents near
+    a given point without checking all of them.
+    """
+    def __init__(self, expiration_time=None, cell_size=1.):
+        dict.__init__(self)
+        self.expiration_time = expiration_time
+        self.sent = {}
+        self.received = {}
+        self.heap = []
+        self.lock = threading.Lock()
+        self.version = 0
+        self.last_snapshot = AgentSnapshot((), 0)
+        self.index = SpatialHash(cell_size)
+        return
+
+    def update_agent(self, ID, state, sent=None, received=None):
+        """Store *state* as the last known state of
+        agent *ID*, sent at time *sent* and received
+        at time *received* (now if not given).
+        If *sent* is not given, the reception time
+        is used instead.
+        """
+        if received is None:
+            received = time()
+        if sent is None:
+            sent = received
+        with self.lock:
+            self[ID] = state
+            self.sent[ID] = sent
+            self.received[ID] = received
+            self.version += 1
+            try:
+                self.index.insert(ID, state)
+            except TypeError:  # no position in state
+                self.index.remove(ID)
+            heapq.heappush(self.heap, (sent, ID))
+            # Old entries of agents updated since are only
+            # discarded when popped, rebuild if too many:
+            if len(self.heap) > 2 * len(self) + 32:
+                self.heap = [(t, i) for i, t in self.sent.items()]
+                heapq.heapify(self.heap)
+        return state
+
+    def remove_agent(self, ID):
+        """Remove agent *ID* from the table.
+        Its entries in the heap are discarded
+        lazily when they are popped.
+        """
+        with self.lock:
+            if self.pop(ID, None) is not None:
+                self.version += 1
+            self.sent.pop(ID, None)
+            self.received.pop(ID, None)
+            self.index.remove(ID)
+        return
+
+    def prune(self, max_age=None, now=None):
+        """Evict every agent whose last state was sent
+        more than *max_age* seconds ago (by default,
+        self.expiration_time). Does nothing if neither
+        is defined.
+        Return the number of agents evicted.
+        """
+        if max_age is None:
+            max_age = self.expiration_time
+        if max_age is None:
+            return 0
+        if now is None:
+            now = time()
+        limit = now - max_age
+        evicted = 0
+        with self.lock:
+            while self.heap and self.heap[0][0] < limit:
+                sent, ID = heapq.heappop(self.heap)
+                if self.sent.get(ID) == sent:  # else it is outdated
+                    del self[ID]
+                    del self.sent[ID]
+                    del self.received[ID]
+                    self.index.remove(ID)
+                    evicted += 1
+            if evicted:
+                self.version += 1
+        return evicted
+
+    def age(self, ID, now=None):
+        """Return the seconds since the last
+        state of agent *ID* was sent.
+        """
+        if now is None:
+            now = time()
+        return now - self.sent[ID]
+
+    def clear(self):
+        with self.lock:
+            dict.clear(self)
+            self.sent.clear()
+            self.received.clear()
+            self.heap = []
+            self.index.clear()
+            self.version += 1
+        return
+
+    def agents_within(self, pos, r):
+        """Return a dictionary { ID: (x, y, heading) } with
+        the agents at less than *r* from *pos*.
+        """
+        with self.lock:
+            return dict((ID, self[ID])
+                        for d2, ID, p in self.index.within(pos, r))
+
+    def k_nearest(self, pos, k):
+        """Return a list of (ID, (x, y, heading)) with the
+        *k* agents closest to *pos*, from closest to farthest.
+        """
+        with self.lock:
+            return [(ID, self[ID])
+                    for d2, ID, p in self.index.nearest(pos, k)]
+
+    def get_state(self):
+        """Return a dictionary with the states
+        and times stored in the table.
+        """
+        with self.lock:
+            return {"states": dict(self),
+                    "sent": dict(self.sent),
+                    "received": dict(self.received)}
+
+    def set_state(self, state, clock_offset=0.):
+        """Replace the content of the table with *state*,
+        as returned by get_state(), shifting all the times
+        by *clock_offset* seconds (e.g. the time elapsed
+        since the state was saved, so that the ages of
+        the agents are kept).
+        """
+        self.clear()
+        for ID, agent in state["states"].items():
+            self.update_agent(ID, agent,
+                              state["sent"][ID] + clock_offset,
+                              state["received"][ID] + clock_offset)
+        return
+
+    def snapshot(self):
+        """Return an AgentSnapshot of the table. The same
+        snapshot is returned until the table changes, so
+        consumers can compare its version to skip any
+        recomputation when nothing changed.
+        """
+        with self.lock:
+            if self.last_snapshot.version != self.version:
+                self.last_snapshot = AgentSnapshot(self, self.version)
+            return self.last_snapshot
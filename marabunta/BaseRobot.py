@@ -1,8 +1,10 @@
 # import math as m
 from math import pi, sin, cos, atan2, sqrt
 import threading
+import Queue
 from time import sleep, time
 from utils import clean_angle
+from AgentTable import AgentTable, AgentSnapshot
 
 
 class BaseRobot(object):
@@ -44,6 +46,7 @@ class BaseRobot(object):
         self.working = False
         self.printing = False
         self.last_target = [0., 0.]
+        self.navigation = None
         return
 
     def is_working(self):
@@ -126,6 +129,10 @@ class BaseRobot(object):
         a given vector *direction*.
         Looks for an align method in *self.body*
         but one is not required.
+        Bodies moved by an UnicycleIntegrator (or with
+        a background controller, as eBotBody) only turn
+        later, so the heading is not updated yet when
+        this returns.
         """
         if "align" in dir(self.body):
             dtheta = self.body.align(direction)
@@ -143,38 +150,128 @@ class BaseRobot(object):
         thread until the point is reached
         within *tol* accuracy or *max_time*
         seconds have passed.
+        Use start_navigation() to move
+        without blocking.
         """
-        end_time = time() + max_time
-        v = self.body.max_speed
-        while time() < end_time:
-            delta = [target[0] - self.body.get_position()[0],
-                     target[1] - self.body.get_position()[1]]
-            distance = sqrt(delta[0] * delta[0] + delta[1] * delta[1])
-            if distance > tol:
-                delta = self.correct_target_projecting(delta)
-                self.align(delta)
-                self.move_forward(distance / v, v)
-                sleep(0.1)
-            else:
-                self.stop()
-                break
-        return
+        self.start_navigation([target], tol, max_time)
+        return self.wait_navigation()
 
     def follow_path(self, targets, tol=0.8, max_time_ppt=120):
         """Move the robot along the path
-        specified by *targets*.
-        Uses the self.go_to method.
+        specified by *targets*, blocking
+        the main thread until the last
+        point is reached.
+        Use start_navigation() to move
+        without blocking.
         """
-        for target in targets:
-            self.go_to(target, tol, max_time_ppt)
-        return
+        self.start_navigation(targets, tol, max_time_ppt)
+        return self.wait_navigation()
+
+    def start_navigation(self, targets, tol=0.8, max_time_ppt=120, v=None):
+        """Start moving the robot along the path
+        specified by *targets* without blocking.
+        Each waypoint is considered reached when
+        the robot is within *tol* of it, and the
+        navigation is given up if a waypoint is not
+        reached in *max_time_ppt* seconds.
+        The robot only moves when navigate(dt) is
+        called, typically from its update(dt) method,
+        so it can keep broadcasting and processing
+        messages while it navigates, and a simulator
+        can step any number of navigating robots in
+        the same loop.
+        Any previous navigation is cancelled.
+        Return the Navigation handle.
+        """
+        if self.navigation is not None:
+            self.navigation.cancel()
+        self.navigation = Navigation(targets, tol, max_time_ppt, v)
+        return self.navigation
+
+    def navigate(self, dt):
+        """Advance the current navigation (see
+        start_navigation) by *dt* seconds, moving
+        the robot towards its current waypoint.
+        Return True if the robot was moved, False if
+        there is no navigation in progress (or the
+        robot is not working).
+        """
+        if self.navigation is None or not self.is_working():
+            return False
+        return self.navigation.step(self, dt)
+
+    def wait_navigation(self, period=0.1):
+        """Block the main thread advancing the current
+        navigation every *period* seconds until it is
+        done. The state of the robot is broadcast
+        during the whole trip.
+        Return the final state of the navigation.
+        """
+        navigation = self.navigation
+        if navigation is None:
+            return None
+        last_time = time()
+        while not navigation.done() and self.is_working():
+            self.broadcast_state()
+            now = time()
+            self.navigate(now - last_time)
+            last_time = now
+            sleep(period)
+        return navigation.state
+
+    def navigate_to(self, target, planner, tol=0.8, max_time_ppt=120):
+        """Move the robot to *target* following the path
+        around the obstacles given by *planner* (a
+        GridPlanner) instead of a straight line.
+        Uses the self.follow_path method.
+        Return the path followed, or None if the target
+        cannot be reached.
+        """
+        path = planner.plan(self.body.get_position(), target)
+        if path:
+            self.follow_path(path, tol, max_time_ppt)
+        return path
+
+    def submit(self, v=None, omega=None, heading=None, duration=0.):
+        """If the robot is working, submit a command to
+        the body without waiting for it to be executed
+        (see BaseBody.submit) and return its handle.
+        The speed is set to zero if there is an obstacle
+        in front. Returns None if the robot is not working.
+        """
+        if not self.is_working():
+            return None
+        if v and self.obstacle_infront():
+            v = 0.0
+        return self.body.submit(v, omega, heading, duration)
 
 # Communication methods:
 
-    def get_agents(self):
-        """Return a dictionary with the state of each robot.
+    def get_agents(self, max_age=None):
+        """Return a read-only dictionary with the state of
+        each robot (see BaseNetwork.get_agents_snapshot).
+        If *max_age* is given, ignore the robots whose state
+        was sent more than *max_age* seconds ago.
         """
-        return self.network.get_agents_state()
+        return self.network.get_agents_snapshot(max_age)
+
+    def get_neighbors(self, radius=None, k=None):
+        """Return a dictionary with the state of the robots
+        near this one: the ones at less than *radius* if
+        given, and the *k* closest ones if given.
+        If neither is given, return all (see get_agents).
+        """
+        if radius is None and k is None:
+            return self.get_agents()
+        pos = self.body.get_position()
+        if k is None:
+            return self.network.agents_within(pos, radius)
+        neighbors = self.network.k_nearest(pos, k)
+        if radius is not None:
+            r2 = radius * radius
+            neighbors = [(ID, a) for ID, a in neighbors
+                         if (a[0] - pos[0])**2 + (a[1] - pos[1])**2 < r2]
+        return dict(neighbors)
 
     def broadcast_state(self):
         """Broadcast current state (x,y,heading) over
@@ -363,6 +460,159 @@ class BaseRobot(object):
                 raise Exception("Could not stop printing thread properly")
         return
 
+# Checkpoint methods:
+
+    # Attributes that are not part of the state of the model
+    transient_attributes = ("body", "network", "working",
+                            "printing", "print_thread")
+
+    def get_state(self):
+        """Return a dictionary with the state of the
+        robot, made of the state of its body and network
+        and the attributes of the model (last_target,
+        rendezvous_point, path...). The values are not
+        copied, so the dictionary should be serialized
+        (see save_checkpoint) before the robot is
+        updated again.
+        """
+        model = dict((key, value) for key, value in self.__dict__.items()
+                     if key not in self.transient_attributes)
+        return {"model": model,
+                "body": self.body.get_state(),
+                "network": self.network.get_state()}
+
+    def set_state(self, state, clock_offset=0.):
+        """Restore the robot to *state*, as returned
+        by get_state(). The times stored by the network
+        are shifted by *clock_offset* seconds.
+        """
+        self.__dict__.update(state["model"])
+        self.body.set_state(state["body"])
+        self.network.set_state(state["network"], clock_offset)
+        return
+
+
+class BodyCommand(object):
+    """Handle of a command submitted to a body through
+    BaseBody.submit(). The command asks the body to
+    turn to *heading* (if given) and then move during
+    *duration* seconds with linear speed *v* and, if
+    given, angular speed *omega*.
+    The handle can be used to check if the command
+    is done, wait for it, or cancel it.
+    """
+    def __init__(self, v=None, omega=None, heading=None, duration=0.):
+        self.v = v
+        self.omega = omega
+        self.heading = heading
+        self.duration = duration
+        self.cancelled = False
+        self.error = None
+        self.finished = threading.Event()
+        return
+
+    def done(self):
+        """Return True if the command has been
+        executed, cancelled, or failed.
+        """
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the command is done or
+        *timeout* seconds have passed.
+        Return True if the command is done.
+        """
+        self.finished.wait(timeout)
+        return self.finished.is_set()
+
+    def cancel(self):
+        """Ask the body to skip the command, or to stop
+        it as soon as possible if it is being executed.
+        Return False if the command was already done.
+        """
+        self.cancelled = True
+        return not self.done()
+
+
+class Navigation(object):
+    """Handle of a navigation started with
+    BaseRobot.start_navigation(). It is a small
+    state machine that moves the robot along
+    *targets* one step at a time, each time step()
+    is called. Its state is one of:
+        "active": still moving,
+        "arrived": the last target was reached,
+        "timeout": a target was not reached in
+            *max_time_ppt* seconds,
+        "cancelled": cancel() was called.
+    The time is measured adding up the *dt* of each
+    step, so it also works for simulations that are
+    not run in real time.
+    """
+    def __init__(self, targets, tol=0.8, max_time_ppt=120, v=None):
+        self.targets = [tuple(target) for target in targets]
+        self.tol = tol
+        self.max_time_ppt = max_time_ppt
+        self.v = v
+        self.index = 0
+        self.elapsed = 0.
+        self.state = "active" if self.targets else "arrived"
+        return
+
+    def done(self):
+        """Return True if the navigation has
+        finished, for any reason.
+        """
+        return self.state != "active"
+
+    def cancel(self):
+        """Stop the navigation. The robot is not
+        moved again by it.
+        Return False if it was already done.
+        """
+        if self.done():
+            return False
+        self.state = "cancelled"
+        return True
+
+    def target(self):
+        """Return the current waypoint, or None
+        if the navigation is done.
+        """
+        if self.done():
+            return None
+        return self.targets[self.index]
+
+    def step(self, robot, dt):
+        """Move *robot* towards the current waypoint
+        during *dt* seconds, skipping to the next
+        waypoint(s) if it has been reached.
+        The robot is stopped when the navigation ends.
+        Return True if the robot was moved.
+        """
+        while not self.done():
+            x, y = robot.body.get_position()
+            target = self.targets[self.index]
+            delta = [target[0] - x, target[1] - y]
+            distance = sqrt(delta[0] * delta[0] + delta[1] * delta[1])
+            if distance <= self.tol:
+                self.index += 1
+                self.elapsed = 0.
+                if self.index == len(self.targets):
+                    self.state = "arrived"
+                    robot.stop()
+            elif self.elapsed >= self.max_time_ppt:
+                self.state = "timeout"
+                robot.stop()
+            else:
+                self.elapsed += dt
+                v = self.v if self.v is not None else robot.body.max_speed
+                delta = robot.correct_target(delta)
+                robot.align(delta)
+                robot.move_forward(min(dt, distance / v), v)
+                return True
+        return False
+
 
 class BaseBody(object):
     """Minimal model of Body with the required methods
@@ -370,8 +620,13 @@ class BaseBody(object):
     models should inherit from this class to
     be accepted by BaseRobot.
     All the methods below should be overwritten
-    by each body model.
+    by each body model, except for the methods
+    to submit non-blocking commands, that only
+    rely on the other methods.
     """
+    synchronous_commands = False
+    command_step = 0.5  # max time between checks for cancellation
+    commands_lock = threading.Lock()
 
     def get_position(self):
         """Returns the x,y coordinates of the robot.
@@ -423,6 +678,22 @@ class BaseBody(object):
         return [(ob[0] + pos[0], ob[1] + pos[1])
                 for ob in self.obstacle_coordinates()]
 
+    def obstacle_repulsion(self):
+        """Return the vector [fx, fy] pointing away from
+        the detected obstacles, where each obstacle at a
+        distance d contributes with a weight 1/d**3.
+        Bodies that know the map in advance can override
+        this method with a faster lookup.
+        """
+        force = [0., 0.]
+        for ob in self.obstacle_coordinates():
+            d2 = ob[0]**2 + ob[1]**2
+            if d2 > 0:
+                weight = (1.0 / d2)**1.5
+                force[0] -= ob[0] * weight
+                force[1] -= ob[1] * weight
+        return force
+
     def obstacle_infront(self):
         """Return True if an obstacle is "in front", meaning
         that extreme measures such as stopping the movement
@@ -442,6 +713,142 @@ class BaseBody(object):
         raise Exception("body.obstacle_near() not implemented")
         return False
 
+    def get_state(self):
+        """Return a dictionary with the state of the
+        body needed to restore it with set_state().
+        """
+        return {"pos": list(self.get_position()),
+                "heading": self.get_heading()}
+
+    def set_state(self, state):
+        """Restore the body to *state*, as returned
+        by get_state(). Only possible for simulated bodies.
+        """
+        raise Exception("body.set_state() not implemented")
+        return
+
+# Non-blocking commands:
+
+    def submit(self, v=None, omega=None, heading=None, duration=0.):
+        """Put a command in the command queue of the body
+        and return inmediately a BodyCommand handle to
+        follow its execution. The commands are executed
+        one after another in a background thread (started
+        the first time this is called) so that the caller
+        can keep working while the body moves.
+        Bodies whose movements are instantaneous (like
+        MockBody) set *synchronous_commands* to True and
+        execute the command before returning.
+        """
+        command = BodyCommand(v, omega, heading, duration)
+        if self.synchronous_commands:
+            self.run_command(command)
+        else:
+            self.start_commands()
+            self.commands.put(command)
+        return command
+
+    def execute(self, command):
+        """Perform *command* blocking until it is done,
+        using the blocking movement methods of the body.
+        The movement is split in steps of at most
+        *command_step* seconds, so that a cancelled
+        command stops after the current step (unless
+        the commands are synchronous).
+        Bodies able to do better (e.g. by setting the
+        targets of a background controller) should
+        overwrite this method.
+        """
+        if command.heading is not None:
+            self.rotate(clean_angle(command.heading - self.get_heading()))
+        remaining = command.duration
+        if self.synchronous_commands:
+            step = remaining
+        else:
+            step = self.command_step
+        while remaining > 0. and not command.cancelled:
+            dt = min(step, remaining)
+            if command.omega and "move" in dir(self):
+                self.move(dt, command.v or 0., command.omega)
+            else:
+                self.move_forward(dt, command.v)
+            remaining -= dt
+        return
+
+    def run_command(self, command):
+        """Execute *command* unless it was cancelled,
+        store any exception in command.error and
+        mark the command as done.
+        """
+        self.current_command = command
+        try:
+            if not command.cancelled:
+                self.execute(command)
+        except Exception as e:
+            command.error = e
+        finally:
+            self.current_command = None
+        command.finished.set()
+        return command
+
+    def process_commands(self):
+        """Function meant to be called in a separate
+        thread to execute the commands in the queue
+        in order. A None in the queue ends the thread.
+        """
+        while True:
+            command = self.commands.get()
+            if command is None:
+                break
+            self.run_command(command)
+        return
+
+    def start_commands(self):
+        """Start the thread executing the command queue
+        if it is not running yet.
+        """
+        with self.commands_lock:
+            if getattr(self, "command_thread", None) is None:
+                self.commands = Queue.Queue()
+                self.command_thread = threading.Thread(
+                    target=self.process_commands)
+                self.command_thread.daemon = True
+                self.command_thread.start()
+        return
+
+    def stop_commands(self, cancel=True):
+        """Stop the thread executing the command queue.
+        If *cancel* is True, the command being executed
+        and the ones still in the queue are cancelled and
+        the body is halted (if it has a halt method), else
+        they are executed first.
+        """
+        with self.commands_lock:
+            thread = getattr(self, "command_thread", None)
+            if thread is None:
+                return
+            commands = self.commands
+            self.command_thread = None
+        if cancel:
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except Queue.Empty:
+                    break
+                if command is not None:
+                    command.cancel()
+                    command.finished.set()
+            current = getattr(self, "current_command", None)
+            if current is not None:
+                current.cancel()
+            if "halt" in dir(self):
+                self.halt()
+        commands.put(None)
+        thread.join(10)
+        if thread.is_alive():
+            raise Exception("Could not stop command thread properly")
+        return
+
 
 class BaseNetwork(object):
     """Minimal model of Network with the required methods
@@ -465,14 +872,69 @@ class BaseNetwork(object):
         raise Exception("network.stop_broadcasting() not implemented")
         return
 
-    def get_agents_state(self):
+    def get_agents_state(self, max_age=None):
         """Return a dictionary with the state (x,y,heading) of each robot
-        detected in the network."""
+        detected in the network. If *max_age* is given, the robots whose
+        state was sent more than *max_age* seconds ago are not included.
+        Networks can use an AgentTable to store the states so that this
+        filtering is cheap."""
         raise Exception("network.get_agents_state() not implemented")
         return {"robot1": [0., 0., 0.],
                 "robot2": [0., 0., 0.],
                 "robotN": [0., 0., 0.]}
 
+    def get_agents_snapshot(self, max_age=None):
+        """Return an AgentSnapshot, a read-only dictionary
+        with the state of each robot that is safe to iterate
+        while the network receives new data.
+        If the network stores the states in an AgentTable,
+        the snapshot is only rebuilt when new data arrived
+        and its version tells whether anything changed.
+        Otherwise, a copy with an unknown version (None)
+        is returned.
+        """
+        if max_age is None:
+            agents = self.get_agents_state()
+        else:
+            agents = self.get_agents_state(max_age)
+        if isinstance(agents, AgentTable):
+            return agents.snapshot()
+        return AgentSnapshot(agents)
+
+    def agents_within(self, pos, r, max_age=None):
+        """Return a dictionary with the state of the robots
+        at a distance smaller than *r* from *pos*.
+        If the network stores the states in an AgentTable,
+        only the robots in the cells around *pos* are
+        checked. Otherwise, every robot is checked.
+        """
+        if max_age is None:
+            agents = self.get_agents_state()
+        else:
+            agents = self.get_agents_state(max_age)
+        if isinstance(agents, AgentTable):
+            return agents.agents_within(pos, r)
+        r2 = r * r
+        return dict((ID, a) for ID, a in agents.items()
+                    if (a[0] - pos[0])**2 + (a[1] - pos[1])**2 < r2)
+
+    def k_nearest(self, pos, k, max_age=None):
+        """Return a list of (ID, state) with the *k* robots
+        closest to *pos*, sorted from closest to farthest.
+        If the network stores the states in an AgentTable,
+        the search only visits the cells around *pos*
+        until the *k* robots are found.
+        """
+        if max_age is None:
+            agents = self.get_agents_state()
+        else:
+            agents = self.get_agents_state(max_age)
+        if isinstance(agents, AgentTable):
+            return agents.k_nearest(pos, k)
+        dists = sorted(((a[0] - pos[0])**2 + (a[1] - pos[1])**2, ID, a)
+                       for ID, a in agents.items())
+        return [(ID, a) for d2, ID, a in dists[:k]]
+
     def send_state(self, position, heading):
         """Broadcast the current state (position[0], position[1], heading)
         of the robot over the network.
@@ -481,6 +943,38 @@ class BaseNetwork(object):
         raise Exception("network.send_position() not implemented")
         return "Robot1\t0.\t0.\t0."
 
+    def get_state(self):
+        """Return a dictionary with the data received by
+        the network: the table of agent states (self.poses),
+        the obstacles (self.obstacles), and the messages
+        not read yet (self.inbox), for the networks that
+        store them there.
+        """
+        state = {}
+        if isinstance(getattr(self, "poses", None), AgentTable):
+            state["poses"] = self.poses.get_state()
+        if hasattr(self, "obstacles"):
+            state["obstacles"] = dict(self.obstacles)
+        if hasattr(self, "inbox"):
+            state["inbox"] = list(self.inbox.items)
+        return state
+
+    def set_state(self, state, clock_offset=0.):
+        """Restore the data received by the network from
+        *state*, as returned by get_state(), shifting
+        the times stored by *clock_offset* seconds.
+        """
+        if "poses" in state:
+            self.poses.set_state(state["poses"], clock_offset)
+        if "obstacles" in state:
+            self.obstacles.clear()
+            self.obstacles.update(state["obstacles"])
+        if "inbox" in state:
+            with self.inbox.lock:
+                self.inbox.items.clear()
+                self.inbox.items.extend(state["inbox"])
+        return
+
     # To use network with the "with Network(...) as network:" statement
     def __enter__(self):
         self.start_broadcasting()
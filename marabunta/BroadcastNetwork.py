@@ -0,0 +1,310 @@
+from random import randint
+from time import time, sleep
+import threading
+import sys
+from BaseRobot import BaseNetwork
+from AgentTable import AgentTable
+from utils import RingQueue, message_word
+
+
+class BroadcastNetwork(BaseNetwork):
+    """Common part of the networks where every agent
+    broadcasts text messages to all the others (e.g.
+    XBeeNetwork and UDPNetwork).
+    The content of each message is defined by its first
+    two characters ("xx", "tt", "oo", "xo", "up", "ss",
+    "mm") and ends with the time and the ID of the sender
+    (except the generic "mm" messages).
+    If *period* is given, messages are only sent at the
+    time slots specified by *window_start*, *window_end*,
+    and *period*. If not, every message is sent as soon
+    as it is produced.
+    The inbox and outbox are bounded to *inbox_size* and
+    *outbox_size* items, following the drop policies in
+    *inbox_policies* and *outbox_policies* (see RingQueue).
+    Subclasses implement the transport: write(message),
+    the threads started by start_broadcasting() and
+    read_background().
+    """
+    inbox_policies = {}
+    outbox_policies = {"xx": "coalesce", "tt": "coalesce", "xo": "coalesce"}
+
+    def __init__(self, ID=None, window_start=None, window_end=None,
+                 period=None, inbox_size=64, outbox_size=16):
+        if period is not None:
+            assert period > 0.
+            assert window_start >= 0. and window_start < period
+            assert window_end > window_start and window_end <= period
+        self.window_start = window_start
+        self.window_end = window_end
+        self.period = period
+        if ID:
+            self.ID = str(ID)
+        else:
+            self.ID = str(randint(0, 999999))
+        self.broadcasting = False
+        self.poses = AgentTable()
+        self.obstacles = {}
+        self.obstimes = {}
+        self.inbox = RingQueue(inbox_size, self.inbox_policies,
+                               kind=message_word)
+        self.outbox = RingQueue(outbox_size, self.outbox_policies)
+        self.awake = threading.Event()
+        self.awake.set()
+        self.parser = {"xx": self.parse_state,
+                       "tt": self.parse_heading,
+                       "oo": self.parse_obstacles,
+                       "xo": self.parse_state_obstacles,
+                       "up": self.parse_wakeup,
+                       "ss": self.parse_sleep,
+                       "mm": self.parse_message}
+        return
+
+    def __enter__(self):
+        self.start_broadcasting()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop_broadcasting()
+        return
+
+    def is_awake(self):
+        return self.awake.is_set()
+
+# Sending methods:
+
+    def post(self, message, low_priority=False):
+        """Send *message* right away if no time slots
+        are used, else put it in the outbox to be sent
+        in the next time slot. Low priority messages
+        are only scheduled if the outbox is empty.
+        """
+        if self.period is None:
+            if self.broadcasting and self.is_awake():
+                self.write(message)
+        elif not low_priority or self.outbox.empty():
+            self.outbox.put(message)
+        return message
+
+    def send_state(self, pos, heading):
+        """Send string of the form:
+                "xx*x*  *y*   *heading* *time*    *ID*"
+        This is a low priority message, it is only scheduled
+        to send if there is no other message in the stack.
+        """
+        message = "xx{:.5f}\t{:.5f}\t{:.5f}\t{:.5f}\t{:}\n".format(
+            pos[0], pos[1], heading, time(), self.ID)
+        return self.post(message, low_priority=True)
+
+    def send_heading(self, heading):
+        """Send string of the form:
+                "tt*heading*    *time*    *ID*"
+        This is a low priority message, it is only scheduled
+        to send if there is no other message in the stack.
+        """
+        message = "tt{:.5f}\t{:.5f}\t{:}\n".format(heading, time(), self.ID)
+        return self.post(message, low_priority=True)
+
+    def send_obstacles(self, obstacles):
+        """Send string of the form:
+                "oo*x1*:*y1*    *x2*:*y2* (...) *time* *ID*"
+        The message can contain an arbitrary number of obstacles
+        (but it is not guaranteed to be sent correctly if there
+        are too many).
+        """
+        obstacles_str = "".join("{:.2f}:{:.2f}\t".format(*o)
+                                for o in obstacles)
+        message = "oo{:}{:.5f}\t{:}\n".format(obstacles_str, time(), self.ID)
+        return self.post(message)
+
+    def send_state_obstacles(self, pos, heading, obstacles):
+        """Send string of the form:
+            "xo*x*  *y*   *heading* *x1*:*y1*    *x2*:*y2* (...) *time* *ID*"
+        The message can contain an arbitrary number of obstacles
+        (but it is not guaranteed to be sent correctly if there
+        are too many).
+        """
+        obstacles_str = "".join("{:.2f}:{:.2f}\t".format(*o)
+                                for o in obstacles)
+        message = "xo{:.5f}\t{:.5f}\t{:.5f}\t{:}{:.5f}\t{:}\n".format(
+            pos[0], pos[1], heading, obstacles_str, time(), self.ID)
+        return self.post(message, low_priority=True)
+
+    def send_wakeup(self):
+        """Send wakeup signal to everyone.
+        Message includes the ID and the time.
+        """
+        message = "up{:.5f}\t{:}\n".format(time(), self.ID)
+        return self.post(message)
+
+    def send_sleep(self):
+        """Send sleep signal to everyone.
+        Message includes the ID and the time.
+        """
+        message = "ss{:.5f}\t{:}\n".format(time(), self.ID)
+        return self.post(message)
+
+    def send_message(self, text):
+        """Sends a generic message given
+        as input.
+        """
+        message = "mm" + str(text)
+        return self.post(message)
+
+# Processing incoming methods:
+
+    def parse(self, message):
+        """Parse *message* using the appropiate parser
+        function according to its "key" (first two
+        characters). If the device is asleep, only
+        wakeup signals are processed.
+        New keys should be added to the keys-to-parsers
+        dict, self.parser.
+        """
+        if len(message) < 2:
+            return
+        key = message[0:2]
+        if not self.is_awake() and key != "up":
+            return
+        try:
+            self.parser[key](message[2:])
+        except KeyError:
+            sys.stderr.write("read(): unknown key:\n" + key + "\n")
+        return
+
+    def parse_state(self, message):
+        """Parse a message containing x, y, theta, time, ID"""
+        try:
+            x, y, theta, time, ID = message.rstrip('\n').split()
+            self.poses.update_agent(ID, (float(x), float(y), float(theta)),
+                                    float(time))
+        except:
+            sys.stderr.write("parse_state(): Bad data:\n" + message + "\n")
+        return
+
+    def parse_heading(self, message):
+        """Parse a message containing theta, time, ID"""
+        try:
+            theta, time, ID = message.rstrip('\n').split()
+            self.poses.update_agent(ID, float(theta), float(time))
+        except:
+            sys.stderr.write("parse_heading(): Bad data:\n" + message + "\n")
+        return
+
+    def parse_obstacles(self, message):
+        """Parse a message containing a set of obstacle
+        coordinates.
+        """
+        try:
+            data = message.rstrip('\n').split()
+            ID = data.pop()
+            time = float(data.pop())
+            self.obstacles[ID] = [[float(p) for p in point.split(':')]
+                                  for point in data]
+            self.obstimes[ID] = time
+        except:
+            sys.stderr.write("parse_obstacles(): Bad data:\n" + message + "\n")
+        return
+
+    def parse_state_obstacles(self, message):
+        """Parse a message containing x, y, theta and
+        a set of obstacle coordinates.
+        """
+        try:
+            data = message.rstrip('\n').split()
+            ID = data.pop()
+            time = float(data.pop())
+            x, y, theta = data[:3]
+            self.poses.update_agent(ID, (float(x), float(y), float(theta)),
+                                    time)
+            self.obstacles[ID] = [[float(p) for p in point.split(':')]
+                                  for point in data[3:]]
+            self.obstimes[ID] = time
+        except:
+            sys.stderr.write(
+                "parse_state_obstacles(): Bad data:\n" + message + "\n")
+        return
+
+    def parse_wakeup(self, message):
+        """Wakes up the device."""
+        self.awake.set()
+        return
+
+    def parse_sleep(self, message):
+        """Set the device to sleep. While asleep,
+        nothing is sent and every incoming message
+        other than a wakeup signal is ignored.
+        """
+        self.awake.clear()
+        return
+
+    def parse_message(self, message):
+        self.inbox.put(message)
+        return
+
+    def get_messages(self):
+        """Returns all incoming messages received since
+        last call to this method. The messages are
+        returned in a list sorted from newest to oldest
+        (FILO stack).
+        """
+        return self.inbox.get_all()
+
+    def get_agents_state(self, max_age=None):
+        """Returns the dictionary with the
+        data gathered from the network through the
+        read_background thread regarding the
+        state (position and heading) of the agents.
+        Agents whose last state was sent more than
+        *max_age* seconds ago are evicted first.
+        """
+        self.poses.prune(max_age)
+        return self.poses
+
+    def get_obstacles(self):
+        """Returns the dictionary with the
+        data gathered from the network through the
+        read_background thread regarding the
+        obstacles detected by other agents.
+        """
+        return self.obstacles, self.obstimes
+
+
+# User should not need to call any function below this point
+
+    def write(self, message):
+        """Transmit *message* to the other agents."""
+        raise Exception("network.write() not implemented")
+        return
+
+    def send(self):
+        """Transmit the most recent item put
+        into the outbox. Return the item.
+        """
+        m = self.outbox.get()
+        self.write(m)
+        self.outbox.task_done()
+        return m
+
+    def send_background(self):
+        """Function meant to be called in a separate
+        thread to continuosly check for the time and
+        send the most recent message whenever the
+        time slot is right.
+        Only used when time slots are defined.
+        """
+        while self.broadcasting:
+            t = time() % self.period
+            if t < self.window_start:
+                sleep(self.window_start - t)
+            elif t >= self.window_end:
+                sleep(self.period + self.window_start - t)
+            else:
+                if self.outbox.empty():
+                    sleep((self.window_end - self.window_start) * 0.2)
+                else:
+                    self.send()
+                    # make sure only one message per window is sent:
+                    sleep(self.window_end - time() % self.period)
+            self.awake.wait()  # wait until the device is awake.
+        return
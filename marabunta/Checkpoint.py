@@ -0,0 +1,75 @@
+from time import time
+import cPickle
+import random
+import gzip
+import sys
+import os
+
+
+def save_checkpoint(filename, robots, t=None, extra=None):
+    """Save the state of every robot in *robots* (see
+    BaseRobot.get_state) to the file *filename*, together
+    with the state of the random number generators, the
+    wall clock, the simulation time *t* and any picklable
+    *extra* data (e.g. the metrics or the settings).
+    The data is pickled and compressed with gzip. It is
+    first written to a temporary file that then replaces
+    *filename*, so a crash while saving never leaves a
+    broken checkpoint behind.
+    Objects shared between robots (e.g. a GridPlanner)
+    are stored only once.
+    """
+    checkpoint = {"clock": time(),
+                  "t": t,
+                  "random": random.getstate(),
+                  "IDs": [getattr(robot.network, "ID", None)
+                          for robot in robots],
+                  "robots": [robot.get_state() for robot in robots],
+                  "extra": extra}
+    if "numpy" in sys.modules:
+        checkpoint["numpy_random"] = sys.modules["numpy"].random.get_state()
+    tmpname = filename + ".tmp"
+    f = gzip.open(tmpname, 'wb')
+    try:
+        cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(tmpname, filename)
+    return checkpoint["clock"]
+
+
+def load_checkpoint(filename, robots, shift_clock=True):
+    """Restore *robots* to the state saved in *filename*
+    by save_checkpoint. The robots must have been built
+    in the same way and order as the ones saved (e.g. by
+    the same script), with the same IDs.
+    The random number generators are restored too, so
+    a simulation resumed from a checkpoint continues
+    exactly as the original one would have (checked
+    by examples/checkpoint/resume_check.py).
+    If *shift_clock* is True, the times stored by the
+    networks are shifted by the time elapsed since the
+    checkpoint was saved, so that the agent data does
+    not expire while the simulation was stopped.
+    Return a tuple (t, extra) with the simulation time
+    and the extra data saved.
+    """
+    f = gzip.open(filename, 'rb')
+    try:
+        checkpoint = cPickle.load(f)
+    finally:
+        f.close()
+    if len(checkpoint["robots"]) != len(robots):
+        raise Exception("Checkpoint: {:} robots saved, {:} given".format(
+            len(checkpoint["robots"]), len(robots)))
+    IDs = [getattr(robot.network, "ID", None) for robot in robots]
+    if IDs != checkpoint["IDs"]:
+        raise Exception("Checkpoint: robot IDs do not match")
+    clock_offset = time() - checkpoint["clock"] if shift_clock else 0.
+    for robot, state in zip(robots, checkpoint["robots"]):
+        robot.set_state(state, clock_offset)
+    random.setstate(checkpoint["random"])
+    if "numpy_random" in checkpoint:
+        import numpy
+        numpy.random.set_state(checkpoint["numpy_random"])
+    return checkpoint["t"], checkpoint["extra"]
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class CollisionSolver(object):
+    """Keep simulated robots, modeled as disks of radius
+    *radius*, from overlapping each other.
+    All the robots are processed at once with numpy:
+    the broad phase sorts them in a uniform grid of
+    cells of side 2 * *radius*, so that only the pairs
+    in the same or neighboring cells are checked, and
+    every overlapping pair is then pushed apart along
+    the line joining the centers, each robot moving
+    half of the overlap. Since pushing a pair apart can
+    create new overlaps, this is repeated up to
+    *iterations* times or until no overlap is left.
+    The number of overlapping pairs found in the
+    last call (before resolving them) is kept in
+    self.contacts.
+    """
+    # Half of the 3x3 neighborhood of a cell, so that
+    # each pair of neighboring cells is visited once.
+    stencil = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+    def __init__(self, radius=0.1, iterations=4):
+        assert radius > 0.
+        self.radius = float(radius)
+        self.iterations = iterations
+        self.contacts = 0
+        return
+
+    def resolve(self, positions):
+        """Separate the overlapping disks centered at
+        *positions*, an array of shape (N, 2) that is
+        modified in place.
+        Returns the array of positions.
+        """
+        positions = np.asarray(positions, dtype=float)
+        self.contacts = 0
+        for it in range(self.iterations):
+            i, j = self.candidate_pairs(positions)
+            overlaps = self.separate(positions, i, j)
+            if it == 0:
+                self.contacts = overlaps
+            if not overlaps:
+                break
+        return positions
+
+    def step(self, bodies):
+        """Resolve the collisions between *bodies*, a list
+        of MockBody (or any body with a *pos* list), and
+        move the ones involved in a collision.
+        Returns the number of bodies moved.
+        """
+        if len(bodies) < 2:
+            self.contacts = 0
+            return 0
+        old = np.array([body.pos for body in bodies], dtype=float)
+        new = self.resolve(old.copy())
+        moved = np.nonzero(np.any(new != old, axis=1))[0]
+        for k in moved:
+            bodies[k].pos[0] = float(new[k, 0])
+            bodies[k].pos[1] = float(new[k, 1])
+        return len(moved)
+
+# User should not need to call any function below this point
+
+    def candidate_pairs(self, positions):
+        """Return two arrays (i, j) with the indexes of
+        every pair of disks in the same or neighboring
+        cells of the grid, with i != j and each pair
+        appearing once.
+        """
+        n = len(positions)
+        cells = np.floor(positions / (2. * self.radius)).astype(np.int64)
+        # Shift the cells so that the neighbors of any
+        # cell have valid (non-negative) indexes too.
+        cells -= cells.min(axis=0) - 1
+        rows = cells[:, 1].max() + 2
+        keys = cells[:, 0] * rows + cells[:, 1]
+        order = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        pairs_i = []
+        pairs_j = []
+        for di, dj in self.stencil:
+            neighbor = sorted_keys + (di * rows + dj)
+            lo = np.searchsorted(sorted_keys, neighbor, 'left')
+            hi = np.searchsorted(sorted_keys, neighbor, 'right')
+            if di == 0 and dj == 0:
+                lo = np.arange(n) + 1  # pairs within the cell once
+            counts = np.maximum(hi - lo, 0)
+            total = counts.sum()
+            if not total:
+                continue
+            first = np.repeat(np.arange(n), counts)
+            starts = np.cumsum(counts) - counts
+            second = (np.repeat(lo - starts, counts) +
+                      np.arange(total))
+            pairs_i.append(order[first])
+            pairs_j.append(order[second])
+        if not pairs_i:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+    def separate(self, positions, i, j):
+        """Push apart the pairs (i, j) of disks that
+        overlap, updating *positions* in place.
+        Returns the number of overlapping pairs.
+        """
+        delta = positions[j] - positions[i]
+        d2 = np.einsum('ij,ij->i', delta, delta)
+        diameter = 2. * self.radius
+        hit = d2 < diameter * diameter
+        count = int(hit.sum())
+        if not count:
+            return 0
+        i, j, delta, d = i[hit], j[hit], delta[hit], np.sqrt(d2[hit])
+        # Disks at the same position are split along x
+        same = d == 0.
+        delta[same] = (1., 0.)
+        d[same] = 1.
+        push = (0.5 * (diameter - np.where(same, 0., d)) / d)[:, None] * delta
+        n = len(positions)
+        for axis in (0, 1):
+            positions[:, axis] += (
+                np.bincount(j, push[:, axis], n) -
+                np.bincount(i, push[:, axis], n))
+        return count
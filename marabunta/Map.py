@@ -1,3 +1,44 @@
+from math import floor, ceil, sqrt, sin, cos
+from array import array
+import collections
+
+
+def segment_distance(pos, segment):
+    """Return a tuple (distance, closest point) with the
+    distance from *pos* to the line *segment* ((x1, y1),
+    (x2, y2)) and the point of the segment closest to *pos*.
+    """
+    (x1, y1), (x2, y2) = segment
+    ex, ey = x2 - x1, y2 - y1
+    e2 = ex * ex + ey * ey
+    if e2 > 0.:
+        u = ((pos[0] - x1) * ex + (pos[1] - y1) * ey) / float(e2)
+        u = min(max(u, 0.), 1.)
+    else:
+        u = 0.
+    cx, cy = x1 + u * ex, y1 + u * ey
+    return sqrt((pos[0] - cx)**2 + (pos[1] - cy)**2), (cx, cy)
+
+
+def ray_segment_intersection(pos, direction, segment):
+    """Return the distance *t* along the ray starting at
+    *pos* with unit vector *direction* at which it crosses
+    *segment*, or None if it does not.
+    """
+    (x1, y1), (x2, y2) = segment
+    ex, ey = x2 - x1, y2 - y1
+    dx, dy = direction
+    denom = dx * ey - dy * ex
+    if abs(denom) < 1e-12:  # parallel
+        return None
+    ax, ay = x1 - pos[0], y1 - pos[1]
+    t = (ax * ey - ay * ex) / denom
+    u = (ax * dy - ay * dx) / denom
+    if t >= 0. and 0. <= u <= 1.:
+        return t
+    return None
+
+
 class Map2D(object):
     """Store the position of obstacles in a grid.
     Right now it can only load from a single file.
@@ -7,28 +48,60 @@ class Map2D(object):
     The obstacles are input through *data*.
     This can be either a list of points or
     a filename / file-object with the data in it.
+    Walls can also be given as line *segments*
+    ((x1, y1), (x2, y2)) and *polygons* (lists of
+    vertices), stored in self.segments and indexed
+    by the boxes they cross in self.segment_cells.
+    In that case *data* can be None if there are
+    no point obstacles.
+    If *field_resolution* is given, the repulsion
+    exerted by the obstacles and the distance to the
+    closest one are also precomputed on a grid of
+    points separated by *field_resolution*, so that
+    they can be looked up in O(1) at any position
+    (see precompute_field()).
     """
-    def __init__(self, data, radius, x0=None, xf=None, y0=None, yf=None):
+    bounded = True
+
+    def __init__(self, data, radius, x0=None, xf=None, y0=None, yf=None,
+                 field_resolution=None, field_cutoff=1.4,
+                 segments=None, polygons=None):
         self.minLx = x0
         self.maxLx = xf
         self.minLy = y0
         self.maxLy = yf
         self.obstacles = []
+        self.segments = []
+        self.segment_cells = {}
         self.grid_updated = False
+        self.cells = None
+        self.field_resolution = None
+        self.field_cutoff = field_cutoff
+        self.field_updated = False
+        # Segments first, so the limits deduced from
+        # the points also cover them.
+        if segments:
+            self.add_segments(segments)
+        for polygon in polygons or []:
+            self.add_polygon(polygon)
         self.load_obstacles(data)
         nx = int(self.Lx / radius)
         ny = int(self.Ly / radius)
         self.setup_boxes(nx, ny)
         self.fill_grid()
+        if field_resolution is not None:
+            self.precompute_field(field_resolution, field_cutoff)
         return
 
     def load_obstacles(self, obstacles):
-        if type(obstacles) == str:
+        if isinstance(obstacles, basestring):
             self.add_from_name(obstacles)
         elif type(obstacles) == file:
             self.add_from_file(obstacles)
         elif type(obstacles) == list:
             self.add_from_list(obstacles)
+        elif obstacles is None:
+            self.add_from_list([])
         else:
             raise Exception("Map2D: unknown data type {:}".format(obstacles))
         return
@@ -45,24 +118,39 @@ class Map2D(object):
 
     def add_from_file(self, f):
         """Read a collection of *x y* pairs
-        from the file object *f*.
+        from the file object *f*. Lines with
+        four numbers *x1 y1 x2 y2* are read
+        as segments.
         The dimensions of the available space
         are deduced from these points.
         """
         obstacles = []
+        segments = []
         while True:
             try:
-                x, y = [float(o) for o in f.readline().split()]
-                obstacles.append([x, y])
-            except:
+                values = [float(o) for o in f.readline().split()]
+            except ValueError:
                 break
+            if len(values) == 2:
+                obstacles.append(values)
+            elif len(values) == 4:
+                segments.append(((values[0], values[1]),
+                                 (values[2], values[3])))
+            else:
+                break
+        if segments:
+            self.add_segments(segments)
         self.add_from_list(obstacles)
         return
 
     def add_from_list(self, obstacles):
         """Load the obstacles from *obstacles*."""
-        xs = ([o[0] for o in obstacles])
-        ys = ([o[1] for o in obstacles])
+        xs = ([o[0] for o in obstacles] +
+              [p[0] for segment in self.segments for p in segment])
+        ys = ([o[1] for o in obstacles] +
+              [p[1] for segment in self.segments for p in segment])
+        if not xs:
+            raise Exception("Map2D: no obstacles given")
 
         # Determine the limits of the box
         if self.minLx is None:
@@ -78,8 +166,30 @@ class Map2D(object):
 
         self.obstacles.extend(obstacles)
         self.grid_updated = False
+        self.field_updated = False
         return
 
+    def add_segments(self, segments):
+        """Add the line segments ((x1, y1), (x2, y2))
+        in *segments* as obstacles.
+        """
+        for a, b in segments:
+            self.segments.append(((float(a[0]), float(a[1])),
+                                  (float(b[0]), float(b[1]))))
+        self.grid_updated = False
+        self.field_updated = False
+        return
+
+    def add_polygon(self, vertices, closed=True):
+        """Add the sides of the polygon with *vertices*
+        as segments. If *closed* is False, the last
+        vertex is not joined with the first one.
+        """
+        sides = list(zip(vertices[:-1], vertices[1:]))
+        if closed and len(vertices) > 2:
+            sides.append((vertices[-1], vertices[0]))
+        return self.add_segments(sides)
+
     def setup_boxes(self, nx, ny):
         """ Define how many boxes per axis the grid will have.
         Total number of boxes = nx * ny.
@@ -132,6 +242,8 @@ class Map2D(object):
                         ii = i + di
                         if ii >= 0 and ii < nx:
                             self.grid[ii + jj * nx].append(o)
+        self.cells = None
+        self.index_segments()
         self.grid_updated = True
         return self.grid
 
@@ -150,3 +262,719 @@ class Map2D(object):
                 y = sum(o[1] for o in obs) / len(obs)
                 fmap.append([x, y])
         return fmap
+
+    def box_geometry(self):
+        """Return (x0, y0, width, height) where (x0, y0) is
+        the corner of box (0, 0) and width and height are
+        the size of each box.
+        """
+        return (self.minLx, self.minLy,
+                self.Lx / self.nx, self.Ly / self.ny)
+
+    def box_span(self, low, high, axis):
+        """Return the range of box indexes along *axis*
+        (0 for x, 1 for y) that covers the coordinates
+        from *low* to *high*, clipped to the grid.
+        """
+        origin, size = self.box_geometry()[axis::2]
+        n = self.nx if axis == 0 else self.ny
+        return (max(int(floor((low - origin) / size)), 0),
+                min(int(floor((high - origin) / size)), n - 1))
+
+    def obstacles_in_cell(self, i, j):
+        """Returns a list with the obstacles contained in
+        box (i, j) only, without the surrounding ones.
+        """
+        if self.cells is None:
+            self.cells = [[] for k in range(self.nx * self.ny)]
+            for o in self.obstacles:
+                i0, j0 = self.which_box(o)
+                self.cells[i0 + j0 * self.nx].append(o)
+        return self.cells[i + j * self.nx]
+
+    def index_segments(self):
+        """Store in self.segment_cells = { (i, j): [k] }
+        the index k of every segment that crosses box
+        (i, j). Called by fill_grid().
+        """
+        x0, y0, width, height = self.box_geometry()
+        half_diagonal = 0.5 * sqrt(width * width + height * height)
+        self.segment_cells = {}
+        for k, segment in enumerate(self.segments):
+            (x1, y1), (x2, y2) = segment
+            i0 = int(floor((min(x1, x2) - x0) / width))
+            i1 = int(floor((max(x1, x2) - x0) / width))
+            j0 = int(floor((min(y1, y2) - y0) / height))
+            j1 = int(floor((max(y1, y2) - y0) / height))
+            if self.bounded:
+                i0, i1 = max(i0, 0), min(i1, self.nx - 1)
+                j0, j1 = max(j0, 0), min(j1, self.ny - 1)
+            for j in range(j0, j1 + 1):
+                for i in range(i0, i1 + 1):
+                    center = (x0 + (i + 0.5) * width,
+                              y0 + (j + 0.5) * height)
+                    if segment_distance(center, segment)[0] <= half_diagonal:
+                        self.segment_cells.setdefault((i, j), []).append(k)
+        return self.segment_cells
+
+    def cells_within(self, pos, r):
+        """Yield the (i, j) indexes of the boxes
+        that intersect the circle of radius *r*
+        centered at *pos*.
+        """
+        x, y = pos
+        x0, y0, width, height = self.box_geometry()
+        j0, j1 = self.box_span(y - r, y + r, 1)
+        for j in range(j0, j1 + 1):
+            # Distance from pos to the row of boxes j
+            bottom = y0 + j * height
+            if y < bottom:
+                dy = bottom - y
+            elif y > bottom + height:
+                dy = y - bottom - height
+            else:
+                dy = 0.
+            if dy > r:
+                continue
+            dx = sqrt(r * r - dy * dy)
+            i0, i1 = self.box_span(x - dx, x + dx, 0)
+            for i in range(i0, i1 + 1):
+                yield i, j
+        return
+
+    def obstacles_within(self, pos, r):
+        """Returns a list with the obstacles at a distance
+        smaller than *r* from *pos*, for any *r*. Only the
+        boxes that intersect the circle are visited.
+        For each segment closer than *r*, its point
+        closest to *pos* is returned as an obstacle.
+        """
+        if not self.grid_updated:
+            self.fill_grid()
+        x, y = pos
+        r2 = r * r
+        found = []
+        segments = set()
+        for i, j in self.cells_within(pos, r):
+            for o in self.obstacles_in_cell(i, j):
+                if (o[0] - x)**2 + (o[1] - y)**2 < r2:
+                    found.append(o)
+            if self.segment_cells:
+                segments.update(self.segment_cells.get((i, j), ()))
+        for k in segments:
+            d, point = segment_distance(pos, self.segments[k])
+            if d < r:
+                found.append([point[0], point[1]])
+        return found
+
+    def segments_within(self, pos, r):
+        """Returns a list of (distance, closest point, segment)
+        with the segments at a distance smaller than *r*
+        from *pos*, sorted from closest to farthest.
+        """
+        if not self.grid_updated:
+            self.fill_grid()
+        segments = set()
+        for c in self.cells_within(pos, r):
+            segments.update(self.segment_cells.get(c, ()))
+        found = []
+        for k in segments:
+            d, point = segment_distance(pos, self.segments[k])
+            if d < r:
+                found.append((d, point, self.segments[k]))
+        found.sort()
+        return found
+
+    def raycast(self, pos, angle, max_range=10.):
+        """Return the distance from *pos* to the first
+        segment found in the direction *angle* (radians),
+        or None if there is none closer than *max_range*.
+        The boxes crossed by the ray are visited in order
+        and the search stops at the first hit.
+        """
+        if not self.grid_updated:
+            self.fill_grid()
+        dx, dy = cos(angle), sin(angle)
+        x0, y0, width, height = self.box_geometry()
+        i = int(floor((pos[0] - x0) / width))
+        j = int(floor((pos[1] - y0) / height))
+        step_i = 1 if dx > 0 else -1
+        step_j = 1 if dy > 0 else -1
+        inf = float('inf')
+        # Distance along the ray to the next vertical/horizontal
+        # box boundary, and between consecutive boundaries:
+        if dx != 0.:
+            next_x = (x0 + (i + (step_i > 0)) * width - pos[0]) / dx
+            delta_x = width / abs(dx)
+        else:
+            next_x = delta_x = inf
+        if dy != 0.:
+            next_y = (y0 + (j + (step_j > 0)) * height - pos[1]) / dy
+            delta_y = height / abs(dy)
+        else:
+            next_y = delta_y = inf
+        t = 0.
+        while t <= max_range:
+            cell_end = min(next_x, next_y)
+            hit = None
+            for k in self.segment_cells.get((i, j), ()):
+                d = ray_segment_intersection(pos, (dx, dy), self.segments[k])
+                if d is not None and (hit is None or d < hit):
+                    hit = d
+            # Hits beyond this box may be missing closer ones
+            if hit is not None and hit <= cell_end + 1e-12:
+                return hit if hit <= max_range else None
+            if next_x < next_y:
+                t = next_x
+                next_x += delta_x
+                i += step_i
+            else:
+                t = next_y
+                next_y += delta_y
+                j += step_j
+        return None
+
+    def nearest_obstacle(self, pos, max_distance=None):
+        """Returns a tuple (distance, obstacle) with the
+        obstacle closest to *pos*, or None if there are no
+        obstacles (closer than *max_distance*, if given).
+        The search radius starts at the size of a box and
+        doubles until an obstacle is found.
+        """
+        if not self.obstacles and not self.segments:
+            return None
+        x, y = pos
+        # Every obstacle is in the limits of the map:
+        farthest = sqrt(max((x - self.minLx)**2, (x - self.maxLx)**2) +
+                        max((y - self.minLy)**2, (y - self.maxLy)**2))
+        if max_distance is None or max_distance > farthest:
+            max_distance = farthest
+        r = min(self.box_geometry()[2:])
+        while True:
+            r = min(r, max_distance)
+            found = self.obstacles_within(pos, r)
+            if found:
+                return min((sqrt((o[0] - x)**2 + (o[1] - y)**2), o)
+                           for o in found)
+            if r >= max_distance:
+                return None
+            r *= 2.
+
+    def precompute_field(self, resolution, cutoff=1.4):
+        """Compute, on a grid of points separated by
+        *resolution* covering the whole map, the
+        repulsion exerted by the obstacles,
+
+            F(r) = sum_o (r - r_o)/|r - r_o|^3 ,
+
+        and the distance to the closest obstacle.
+        Only the obstacles closer than *cutoff* are
+        taken into account, so the distance is at
+        most *cutoff*.
+        The values are stored in self.field_x,
+        self.field_y and self.distance, and
+        interpolated by repulsion() and
+        distance_to_obstacle().
+        """
+        self.field_resolution = float(resolution)
+        self.field_cutoff = cutoff
+        res = self.field_resolution
+        nx = int(ceil(self.Lx / res)) + 1
+        ny = int(ceil(self.Ly / res)) + 1
+        self.field_nx, self.field_ny = nx, ny
+        self.field_x = [0.] * (nx * ny)
+        self.field_y = [0.] * (nx * ny)
+        self.distance = [cutoff] * (nx * ny)
+        reach = int(ceil(cutoff / res))
+        c2 = cutoff * cutoff
+        for o in self.obstacles:
+            i0 = int(round((o[0] - self.minLx) / res))
+            j0 = int(round((o[1] - self.minLy) / res))
+            for j in range(max(0, j0 - reach), min(ny, j0 + reach + 1)):
+                dy = self.minLy + j * res - o[1]
+                for i in range(max(0, i0 - reach), min(nx, i0 + reach + 1)):
+                    dx = self.minLx + i * res - o[0]
+                    d2 = dx * dx + dy * dy
+                    if d2 < c2:
+                        k = i + j * nx
+                        d = sqrt(d2)
+                        if d < self.distance[k]:
+                            self.distance[k] = d
+                        if d2 > 0:
+                            weight = 1. / (d2 * d)
+                            self.field_x[k] += dx * weight
+                            self.field_y[k] += dy * weight
+        # Each segment pushes from its point closest to each node:
+        for segment in self.segments:
+            (x1, y1), (x2, y2) = segment
+            left = min(x1, x2) - cutoff - self.minLx
+            right = max(x1, x2) + cutoff - self.minLx
+            bottom = min(y1, y2) - cutoff - self.minLy
+            top = max(y1, y2) + cutoff - self.minLy
+            i0 = max(0, int(floor(left / res)))
+            i1 = min(nx - 1, int(ceil(right / res)))
+            j0 = max(0, int(floor(bottom / res)))
+            j1 = min(ny - 1, int(ceil(top / res)))
+            for j in range(j0, j1 + 1):
+                y = self.minLy + j * res
+                for i in range(i0, i1 + 1):
+                    x = self.minLx + i * res
+                    d, (cx, cy) = segment_distance((x, y), segment)
+                    if d < cutoff:
+                        k = i + j * nx
+                        if d < self.distance[k]:
+                            self.distance[k] = d
+                        if d > 0:
+                            weight = 1. / (d * d * d)
+                            self.field_x[k] += (x - cx) * weight
+                            self.field_y[k] += (y - cy) * weight
+        self.field_updated = True
+        return
+
+    def interpolate(self, values, pos):
+        """Bilinear interpolation at *pos* of *values*
+        (one of the fields computed by precompute_field).
+        Return None if *pos* is outside the map.
+        """
+        u = (pos[0] - self.minLx) / self.field_resolution
+        v = (pos[1] - self.minLy) / self.field_resolution
+        i, j = int(floor(u)), int(floor(v))
+        if i < 0 or i >= self.field_nx - 1 or j < 0 or j >= self.field_ny - 1:
+            return None
+        u, v = u - i, v - j
+        k = i + j * self.field_nx
+        return ((1. - v) * ((1. - u) * values[k] + u * values[k + 1]) +
+                v * ((1. - u) * values[k + self.field_nx] +
+                     u * values[k + self.field_nx + 1]))
+
+    def repulsion(self, pos):
+        """Return the repulsion vector [fx, fy] exerted
+        at *pos* by the obstacles closer than the cutoff.
+        Interpolated from the precomputed field if there
+        is one, otherwise computed from the obstacles
+        within the cutoff.
+        """
+        if self.field_resolution is not None:
+            if not self.field_updated:
+                self.precompute_field(self.field_resolution,
+                                      self.field_cutoff)
+            fx = self.interpolate(self.field_x, pos)
+            if fx is not None:
+                return [fx, self.interpolate(self.field_y, pos)]
+        force = [0., 0.]
+        for o in self.obstacles_within(pos, self.field_cutoff):
+            dx, dy = pos[0] - o[0], pos[1] - o[1]
+            d2 = dx * dx + dy * dy
+            if d2 > 0:
+                weight = (1. / d2)**1.5
+                force[0] += dx * weight
+                force[1] += dy * weight
+        return force
+
+    def distance_to_obstacle(self, pos):
+        """Return the distance from *pos* to the closest
+        obstacle, or the cutoff if there is none closer.
+        Interpolated from the precomputed distance
+        transform if there is one, otherwise computed
+        from the obstacles within the cutoff.
+        """
+        if self.field_resolution is not None:
+            if not self.field_updated:
+                self.precompute_field(self.field_resolution,
+                                      self.field_cutoff)
+            d = self.interpolate(self.distance, pos)
+            if d is not None:
+                return d
+        nearest = self.nearest_obstacle(pos, self.field_cutoff)
+        if nearest is None:
+            return self.field_cutoff
+        return nearest[0]
+
+
+class CompactMap2D(Map2D):
+    """Same as Map2D but storing the grid in compressed
+    sparse row (CSR) layout: the obstacles are sorted by
+    the box that contains them in self.sorted_obstacles,
+    and the obstacles of box k are
+        self.sorted_obstacles[self.offsets[k]:self.offsets[k + 1]].
+    Each obstacle is stored once instead of in the 9
+    lists of its box and the surrounding ones, and the
+    8 surrounding boxes are gathered when the obstacles
+    near a position are requested (three slices, one
+    per row of boxes). The results are the same as
+    with Map2D.
+    """
+    def setup_boxes(self, nx, ny):
+        """ Define how many boxes per axis the grid will have.
+        Total number of boxes = nx * ny.
+        """
+        self.nx = int(nx)
+        self.ny = int(ny)
+        self.grid = None
+        self.sorted_obstacles = []
+        self.offsets = array('l', [0]) * (self.nx * self.ny + 1)
+        return
+
+    def obstacles_in_box(self, i, j):
+        """Returns a list with the obstacles in box (i, j)
+        and the 8 boxes around it.
+        Periodic boundaries implemented, so if i (j) is larger than
+        nx (ny) it is replaced by i%nx (j%ny).
+        """
+        i, j = i % self.nx, j % self.ny
+        nx, offsets, obs = self.nx, self.offsets, self.sorted_obstacles
+        i0 = max(i - 1, 0)
+        i1 = min(i + 1, nx - 1)
+        near = []
+        for jj in range(max(j - 1, 0), min(j + 2, self.ny)):
+            near.extend(obs[offsets[i0 + jj * nx]:offsets[i1 + jj * nx + 1]])
+        return near
+
+    def fill_grid(self):
+        """Sort the obstacles by box with a counting
+        sort and compute the offset of each box.
+        """
+        nx, ny = self.nx, self.ny
+        boxes = []
+        counts = array('l', [0]) * (nx * ny + 1)
+        for o in self.obstacles:
+            i, j = self.which_box(o)
+            k = i + j * nx
+            boxes.append(k)
+            counts[k + 1] += 1
+        for k in range(nx * ny):
+            counts[k + 1] += counts[k]
+        self.offsets = array('l', counts)
+        self.sorted_obstacles = [None] * len(self.obstacles)
+        for o, k in zip(self.obstacles, boxes):
+            self.sorted_obstacles[counts[k]] = o
+            counts[k] += 1
+        self.index_segments()
+        self.grid_updated = True
+        return self.offsets
+
+    def obstacles_in_cell(self, i, j):
+        """Returns a list with the obstacles contained in
+        box (i, j) only, without the surrounding ones.
+        """
+        k = i + j * self.nx
+        return self.sorted_obstacles[self.offsets[k]:self.offsets[k + 1]]
+
+    def filtered_map(self, threshold=1):
+        """For each grid box that contains
+        at least *treshold* obstacles (counting
+        the ones in the 8 boxes around it),
+        return their mean position.
+        """
+        fmap = []
+        if not self.grid_updated:
+            self.fill_grid()
+        for j in range(self.ny):
+            for i in range(self.nx):
+                obs = self.obstacles_in_box(i, j)
+                if len(obs) >= threshold:
+                    x = sum(o[0] for o in obs) / len(obs)
+                    y = sum(o[1] for o in obs) / len(obs)
+                    fmap.append([x, y])
+        return fmap
+
+
+class SparseMap2D(Map2D):
+    """Same as Map2D but storing the obstacles in a
+    dictionary { (i, j): [obstacles] } where only the
+    cells that contain obstacles exist, so the memory
+    used is proportional to the occupied cells and
+    not to the area of the map.
+    The cells are squares of side *radius* aligned
+    with the origin, and positions are not bounded:
+    querying a position far from the map just returns
+    no obstacles. Each obstacle is stored only in
+    its own cell, and the 8 surrounding cells are
+    gathered when the obstacles near a position are
+    requested.
+    The limits of the map (minLx, Lx, ...) are still
+    deduced from the obstacles, but only used to
+    precompute the repulsion field.
+    """
+    bounded = False
+
+    def __init__(self, data, radius, x0=None, xf=None, y0=None, yf=None,
+                 field_resolution=None, field_cutoff=1.4,
+                 segments=None, polygons=None):
+        self.cell_size = float(radius)
+        Map2D.__init__(self, data, radius, x0, xf, y0, yf,
+                       field_resolution, field_cutoff, segments, polygons)
+        return
+
+    def setup_boxes(self, nx, ny):
+        """Only keep the number of boxes per axis covered
+        by the limits of the map, for reference. The
+        cells are created as needed by fill_grid().
+        """
+        self.nx = int(nx)
+        self.ny = int(ny)
+        self.grid = {}
+        return
+
+    def which_box(self, pos):
+        """ Gives the (i,j) indexes corresponding to position pos.
+        """
+        return (int(floor(pos[0] / self.cell_size)),
+                int(floor(pos[1] / self.cell_size)))
+
+    def obstacles_in_box(self, i, j):
+        """Returns a list with the obstacles in box (i, j)
+        and the 8 boxes around it.
+        """
+        grid = self.grid
+        obs = []
+        for dj in (-1, 0, 1):
+            for di in (-1, 0, 1):
+                cell = grid.get((i + di, j + dj))
+                if cell:
+                    obs.extend(cell)
+        return obs
+
+    def box_geometry(self):
+        return (0., 0., self.cell_size, self.cell_size)
+
+    def box_span(self, low, high, axis):
+        """Return the range of cell indexes along *axis*
+        that covers the coordinates from *low* to *high*,
+        clipped to the range of occupied cells.
+        """
+        first, last = self.occupied[axis]
+        return (max(int(floor(low / self.cell_size)), first),
+                min(int(floor(high / self.cell_size)), last))
+
+    def obstacles_in_cell(self, i, j):
+        """Returns a list with the obstacles contained in
+        cell (i, j) only, without the surrounding ones.
+        """
+        return self.grid.get((i, j), ())
+
+    def fill_grid(self):
+        """Store each obstacle in the cell that contains it."""
+        self.grid = {}
+        for o in self.obstacles:
+            self.grid.setdefault(self.which_box(o), []).append(o)
+        self.index_segments()
+        occupied = list(self.grid) + list(self.segment_cells)
+        if occupied:
+            self.occupied = [(min(c[axis] for c in occupied),
+                              max(c[axis] for c in occupied))
+                             for axis in (0, 1)]
+        else:
+            self.occupied = [(0, -1), (0, -1)]
+        self.grid_updated = True
+        return self.grid
+
+    def filtered_map(self, threshold=1):
+        """For each occupied cell whose neighborhood
+        contains at least *treshold* obstacles,
+        return their mean position.
+        """
+        fmap = []
+        if not self.grid_updated:
+            self.fill_grid()
+        for (i, j) in self.grid:
+            obs = self.obstacles_in_box(i, j)
+            if len(obs) >= threshold:
+                x = sum(o[0] for o in obs) / len(obs)
+                y = sum(o[1] for o in obs) / len(obs)
+                fmap.append([x, y])
+        return fmap
+
+
+class SpatialHash(object):
+    """Store points identified by a key in a sparse
+    grid of square cells of side *cell_size*, i.e. a
+    dictionary { (i, j): { key: (x, y) } } where only
+    the occupied cells exist. Points can be moved
+    or removed at any time, and there are no bounds
+    on their position.
+    Used to find the points within a radius or the
+    nearest points to a position looking only at
+    the cells around it.
+    """
+    def __init__(self, cell_size):
+        assert cell_size > 0.
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.where = {}  # key: cell
+        return
+
+    def __len__(self):
+        return len(self.where)
+
+    def cell(self, pos):
+        """Return the (i, j) index of the cell containing *pos*."""
+        return (int(floor(pos[0] / self.cell_size)),
+                int(floor(pos[1] / self.cell_size)))
+
+    def insert(self, key, pos):
+        """Store *key* at position *pos*, moving
+        it if it was already stored.
+        """
+        c = self.cell(pos)
+        old = self.where.get(key)
+        if old is not None and old != c:
+            self.remove(key)
+        self.cells.setdefault(c, {})[key] = (pos[0], pos[1])
+        self.where[key] = c
+        return c
+
+    def remove(self, key):
+        """Remove *key*, if stored."""
+        c = self.where.pop(key, None)
+        if c is not None:
+            cell = self.cells[c]
+            del cell[key]
+            if not cell:
+                del self.cells[c]
+        return
+
+    def clear(self):
+        self.cells = {}
+        self.where = {}
+        return
+
+    def position(self, key):
+        return self.cells[self.where[key]][key]
+
+    def within(self, pos, r):
+        """Return a list of (distance**2, key, position)
+        with every point at a distance smaller than *r*
+        from *pos*. Only the cells intersecting the
+        circle are visited.
+        """
+        x, y = pos
+        r2 = r * r
+        i0, j0 = self.cell((x - r, y - r))
+        i1, j1 = self.cell((x + r, y + r))
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            cells = [cell for (i, j), cell in self.cells.items()
+                     if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            cells = [self.cells[(i, j)]
+                     for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+                     if (i, j) in self.cells]
+        found = []
+        for cell in cells:
+            for key, p in cell.items():
+                d2 = (p[0] - x) ** 2 + (p[1] - y) ** 2
+                if d2 < r2:
+                    found.append((d2, key, p))
+        return found
+
+    def nearest(self, pos, k=1):
+        """Return a list of (distance**2, key, position)
+        with the *k* points closest to *pos*, sorted from
+        closest to farthest. The cells are visited in
+        rings of growing size around *pos* until no
+        unvisited cell can contain a closer point.
+        """
+        x, y = pos
+        ci, cj = self.cell(pos)
+        found = []
+        visited = 0
+        ring = 0
+        while visited < len(self.where):
+            if (2 * ring + 1) ** 2 > 4 * len(self.cells):
+                # The ring is too large for the occupied
+                # cells, faster to check everything left.
+                found = [((p[0] - x) ** 2 + (p[1] - y) ** 2, key, p)
+                         for cell in self.cells.values()
+                         for key, p in cell.items()]
+                break
+            if ring == 0:
+                ring_cells = [(ci, cj)]
+            else:
+                ring_cells = ([(ci + d, cj - ring)
+                               for d in range(-ring, ring + 1)] +
+                              [(ci + d, cj + ring)
+                               for d in range(-ring, ring + 1)] +
+                              [(ci - ring, cj + d)
+                               for d in range(-ring + 1, ring)] +
+                              [(ci + ring, cj + d)
+                               for d in range(-ring + 1, ring)])
+            for c in ring_cells:
+                cell = self.cells.get(c)
+                if cell:
+                    visited += len(cell)
+                    for key, p in cell.items():
+                        found.append(
+                            ((p[0] - x) ** 2 + (p[1] - y) ** 2, key, p))
+            if len(found) >= k:
+                found.sort()
+                # Points not visited yet are at least this far:
+                if found[k - 1][0] <= (ring * self.cell_size) ** 2:
+                    break
+            ring += 1
+        found.sort()
+        return found[:k]
+
+
+class RobotMap(SpatialHash):
+    """Dynamic obstacles made of the simulated bodies
+    moving in the same space, so that they can sense
+    each other as the real robots do with their
+    ultrasound sensors.
+    The bodies are registered with track() and their
+    positions stored in a SpatialHash of cells of side
+    *cell_size* (ideally the sensor range). update()
+    should be called once per tick, after which any
+    body can find the robots around it looking only
+    at the nearby cells, instead of checking every
+    robot in the swarm.
+    Each robot is detected at the point of its disk
+    of radius *body_radius* closest to the sensor
+    (or at its center if the disks overlap). Robots
+    at the exact position of the sensor are ignored,
+    since no direction can be given for them.
+    """
+    def __init__(self, cell_size=1.4, body_radius=0.):
+        SpatialHash.__init__(self, cell_size)
+        self.body_radius = body_radius
+        self.bodies = collections.OrderedDict()  # { id(body): body }
+        return
+
+    def track(self, body):
+        """Add *body* to the robots detected."""
+        if id(body) not in self.bodies:
+            self.bodies[id(body)] = body
+            self.insert(body, body.get_position())
+        return
+
+    def untrack(self, body):
+        """Stop detecting *body*."""
+        if id(body) in self.bodies:
+            del self.bodies[id(body)]
+            self.remove(body)
+        return
+
+    def update(self):
+        """Store the current position of every body.
+        Returns the number of bodies tracked.
+        """
+        for body in self.bodies.values():
+            self.insert(body, body.get_position())
+        return len(self.bodies)
+
+    def robots_within(self, pos, r, exclude=None):
+        """Returns a list with the points of the robots
+        (other than *exclude*) at a distance smaller
+        than *r* from *pos*, as of the last update().
+        """
+        R = self.body_radius
+        x, y = pos
+        found = []
+        for d2, body, p in self.within(pos, r + R):
+            if body is exclude or d2 == 0.:
+                continue
+            if d2 > R * R:
+                f = R / sqrt(d2)
+                found.append([p[0] + f * (x - p[0]), p[1] + f * (y - p[1])])
+            else:
+                found.append([p[0], p[1]])
+        return found
@@ -1,24 +1,64 @@
-from math import sin, cos, sqrt
+from math import sin, cos, sqrt, pi
 from BaseRobot import BaseBody
 from Map import Map2D
 
 
+def arc_step(x, y, heading, v, omega, dt):
+    """Return the (x, y, heading) reached after moving
+    for *dt* with constant linear velocity *v* and
+    angular velocity *omega*, i.e. the exact solution
+    of the unicycle model (an arc of a circle).
+    """
+    half = 0.5 * omega * dt
+    chord = v * dt * (sin(half) / half if half else 1.)
+    return (x + chord * cos(heading + half),
+            y + chord * sin(heading + half),
+            heading + 2. * half)
+
+
 class MockBody(BaseBody):
     """Simulation of a body. Locomotion
     with this body is simply updating
-    the values of *pos* and *heading*.
+    the values of *pos* and *heading*,
+    integrating the motion of a differential
+    drive robot exactly (see move).
+    The speed of each wheel is limited to
+    *max_speed* and, if *max_accel* is given,
+    its change to *max_accel* per second, in
+    which case each move is integrated in
+    *substeps* steps.
     Sensors simulated through a Map instance
     that contains the obstacles to be detected.
+    Commands submitted through submit() are
+    executed inmediately.
+    Obstacles closer than *sensor_range* are
+    detected, regardless of the cell size of
+    the map.
+    Other simulated robots are also detected
+    if the bodies share a RobotMap instance
+    (see load_robots), but only in front of
+    the body, within 2 * *aperture* of the
+    heading (as the five frontal sensors of an
+    eBot, separated by *aperture*).
     """
+    synchronous_commands = True
+
     def __init__(self, pos, heading,
-                 max_speed=0.15, LRdist=0.1, aperture=0.7854):
+                 max_speed=0.15, LRdist=0.1, aperture=0.7854,
+                 sensor_range=1.4, max_accel=None, substeps=1):
         # State
         self.pos = [pos[0], pos[1]]
         self.heading = heading
+        self.wheels = [0., 0.]  # speed of the left and right wheels
         # Parameters
         self.max_speed = max_speed
         self.LRdist = LRdist
         self.aperture = aperture
+        self.sensor_range = sensor_range
+        self.max_accel = max_accel
+        self.substeps = max(1, int(substeps))
+        # UnicycleIntegrator moving this body, if any
+        self.integrator = None
         return
 
     def move_forward(self, dt, v=None):
@@ -26,27 +66,70 @@ class MockBody(BaseBody):
         """
         if v is None or v > self.max_speed:
             v = self.max_speed
-        self.pos[0] += v * cos(self.heading) * dt
-        self.pos[1] += v * sin(self.heading) * dt
+        if self.integrator is not None:
+            self.integrator.command(self, v=v, duration=dt)
+            return
+        self.move(dt, v, 0.)
         return
 
     def rotate(self, dtheta):
-        """Rotate robot an angle dtheta.
+        """Rotate robot an angle dtheta in place and
+        return the time it would take with the wheels
+        at full speed. If the body is moved by an
+        UnicycleIntegrator, the rotation is done while
+        moving during its next step instead.
         """
         time = self.LRdist * abs(dtheta) / (2 * self.max_speed)
+        if self.integrator is not None:
+            self.integrator.command(self, dtheta=dtheta)
+            return time
         self.heading += dtheta
         return time
 
     def move(self, dt, v, omega):
-        """Move the robot with linear velocity v
-        and angular velocity omega.
+        """Move the robot with linear velocity v and
+        angular velocity omega for dt time, along the
+        exact arc of circle. The speeds are reduced
+        (keeping the curvature) if a wheel would go
+        faster than max_speed, and the wheels change
+        their speed at most max_accel per second.
         """
-        dtheta = omega * dt
-        self.rotate(0.5 * dtheta)
-        self.move_forward(dt, v)
-        self.rotate(0.5 * dtheta)
+        if self.integrator is not None:
+            self.integrator.command(self, v=v, omega=omega, duration=dt)
+            return
+        v, omega = self.wheel_limits(v, omega)
+        x, y, heading = self.pos[0], self.pos[1], self.heading
+        if self.max_accel is None:
+            self.wheels = [v - 0.5 * omega * self.LRdist,
+                           v + 0.5 * omega * self.LRdist]
+            x, y, heading = arc_step(x, y, heading, v, omega, dt)
+        else:
+            h = float(dt) / self.substeps
+            dv = self.max_accel * h
+            left, right = self.wheels
+            for step in range(self.substeps):
+                left += min(max(v - 0.5 * omega * self.LRdist - left,
+                                -dv), dv)
+                right += min(max(v + 0.5 * omega * self.LRdist - right,
+                                 -dv), dv)
+                x, y, heading = arc_step(x, y, heading, 0.5 * (left + right),
+                                         (right - left) / self.LRdist, h)
+            self.wheels = [left, right]
+        self.pos[0] = x
+        self.pos[1] = y
+        self.heading = heading
         return
 
+    def wheel_limits(self, v, omega):
+        """Return the velocities (v, omega) scaled down
+        so that no wheel goes faster than max_speed.
+        """
+        fastest = abs(v) + 0.5 * abs(omega) * self.LRdist
+        if fastest > self.max_speed:
+            scale = self.max_speed / fastest
+            return v * scale, omega * scale
+        return v, omega
+
     def get_position(self):
         """Return current estimate for position.
         """
@@ -57,41 +140,143 @@ class MockBody(BaseBody):
         """
         return self.heading
 
-    def load_obstacles(self, filename):
+    def get_state(self):
+        """Return a dictionary with the position,
+        heading and speed of the wheels.
+        """
+        state = BaseBody.get_state(self)
+        state["wheels"] = list(self.wheels)
+        return state
+
+    def set_state(self, state):
+        """Move the body to the position, heading
+        and wheel speeds given in *state*.
+        """
+        self.pos[0] = state["pos"][0]
+        self.pos[1] = state["pos"][1]
+        self.heading = state["heading"]
+        self.wheels = list(state.get("wheels", (0., 0.)))
+        return
+
+    def load_obstacles(self, filename, field_resolution=None, cell_size=0.5):
         """Load the obstacles stored in *filename*
         using a Map2D instance. Using a Map2D will
         automatically store the obstacles in a grid
-        for fast access to nearby obstacles.
+        of boxes of side *cell_size* for fast access
+        to nearby obstacles.
+        If *field_resolution* is given, the obstacle
+        repulsion is also precomputed on a grid with
+        that resolution.
+        *filename* can also be a Map2D instance,
+        so that several bodies can share the same
+        map (and its precomputed fields).
+        """
+        if isinstance(filename, Map2D):
+            self.obstacles = filename
+        else:
+            self.obstacles = Map2D(filename, cell_size,
+                                   field_resolution=field_resolution)
+        return
+
+    def load_robots(self, robot_map):
+        """Detect the other bodies tracked by
+        *robot_map*, a RobotMap instance shared
+        by all the bodies of the simulation.
         """
-        self.obstacles = Map2D(filename, 0.5)
+        self.robots = robot_map
+        robot_map.track(self)
         return
 
+    def detected_obstacles(self):
+        """Return the global coordinates of the
+        obstacles of the map and of the other
+        robots within the sensor range (the robots
+        only if they are in front of the body).
+        """
+        try:
+            obs = self.obstacles.obstacles_within(self.pos, self.sensor_range)
+        except AttributeError:
+            obs = []
+        try:
+            obs += self.robots_in_front()
+        except AttributeError:
+            pass
+        return obs
+
+    def robots_in_front(self):
+        """Return the points of the other robots
+        within the sensor range and less than
+        2 * aperture away from the heading.
+        """
+        robots = self.robots.robots_within(self.pos, self.sensor_range, self)
+        x, y = self.pos
+        ch, sh = cos(self.heading), sin(self.heading)
+        min_cos = cos(min(2. * self.aperture, pi))
+        front = []
+        for o in robots:
+            dx, dy = o[0] - x, o[1] - y
+            if dx * ch + dy * sh >= min_cos * sqrt(dx * dx + dy * dy):
+                front.append(o)
+        return front
+
     def get_ultrasound(self):
         """Return the distance to all the
-        nearby obstacles (as defined by the
-        Map2D instance). If no instance is
-        stored in self.obstacles, return []
+        obstacles within the sensor range.
+        If no Map2D or RobotMap instance is
+        loaded, return []
         """
-        try:
-            obs = self.obstacles.obstacles_near(self.pos)
-        except:
-            return []
+        obs = self.detected_obstacles()
         x, y = self.pos
         return [sqrt((o[0] - x)**2 + (o[1] - y)**2) for o in obs]
 
     def obstacle_coordinates(self):
         """Return the relative position of all the
-        nearby obstacles (as defined by the
-        Map2D instance). If no instance is
-        stored in self.obstacles, return []
+        obstacles within the sensor range.
+        If no Map2D or RobotMap instance is
+        loaded, return []
         """
+        obs = self.detected_obstacles()
+        x, y = self.pos
+        return [[o[0] - x, o[1] - y] for o in obs]
+
+    def get_range(self, angle=0.):
+        """Return the distance to the first wall (segment
+        of the map) in the direction *angle* relative to
+        the heading, or None if there is none within the
+        sensor range or no map is loaded.
+        """
+        try:
+            return self.obstacles.raycast(self.pos, self.heading + angle,
+                                          self.sensor_range)
+        except AttributeError:
+            return None
+
+    def obstacle_repulsion(self):
+        """Return the vector [fx, fy] pointing away from
+        the obstacles near the robot, looked up in the
+        Map2D instance (O(1) if its repulsion field has
+        been precomputed), plus the repulsion of the
+        other robots detected in front if a RobotMap
+        is loaded. If no instance is loaded, return
+        [0, 0].
+        """
+        try:
+            force = self.obstacles.repulsion(self.pos)
+        except AttributeError:
+            force = [0., 0.]
         try:
-            obs = self.obstacles.obstacles_near(self.pos)
-        except:
-            return []
+            robots = self.robots_in_front()
+        except AttributeError:
+            return force
         x, y = self.pos
-        return [[o[0] - x, o[1] - y]
-                for o in obs if (o[0] - x)**2 + (o[1] - y)**2 < 1.4 * 1.4]
+        for o in robots:
+            dx, dy = x - o[0], y - o[1]
+            d2 = dx * dx + dy * dy
+            if d2 > 0:
+                weight = (1. / d2)**1.5
+                force[0] += dx * weight
+                force[1] += dy * weight
+        return force
 
     def obstacle_infront(self):
         """Return True if an obstacle is "in front", meaning
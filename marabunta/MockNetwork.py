@@ -1,8 +1,13 @@
 from random import randint
 from time import time
 from BaseRobot import BaseNetwork
+from AgentTable import AgentTable
+from utils import RingQueue, message_word
+import struct
+import mmap
 import glob
 import sys
+import os
 
 
 class MockNetwork(BaseNetwork):
@@ -13,10 +18,27 @@ class MockNetwork(BaseNetwork):
     broadcasting and where.
     Each agent uses its own file to broadcast
     its state.
+    Incoming text messages are kept in an inbox
+    bounded to *inbox_size* items, following the
+    drop policies in *inbox_policies* (see RingQueue).
+    The files of other agents are only looked for
+    once every *rescan_period* seconds, and only
+    the bytes appended since the last read are
+    parsed.
+    The files are placed in the directory *channel*
+    (the current one by default), so that separate
+    simulations using different channels do not
+    hear each other. If *append* is True, the file
+    of the agent is not emptied when it starts
+    broadcasting (e.g. when resuming a simulation
+    in the same channel).
     """
     basechannel = "radio_{:}.net"
+    inbox_policies = {}
+    tail_size = 512  # bytes read from a file when first found
 
-    def __init__(self, ID=None):
+    def __init__(self, ID=None, inbox_size=64, rescan_period=1.,
+                 channel=None, append=False):
         """Start MockNetwork.
         If an ID is not given, just assign a
         random number.
@@ -30,9 +52,16 @@ class MockNetwork(BaseNetwork):
                        "oo": self.parse_obstacles,
                        "xo": self.parse_position_obstacles,
                        "mm": self.parse_message}
-        self.poses = {}
+        self.poses = AgentTable()
         self.obstacles = {}
-        self.inbox = []
+        self.inbox = RingQueue(inbox_size, self.inbox_policies,
+                               kind=message_word)
+        self.rescan_period = rescan_period
+        self.append = append
+        if channel:
+            self.basechannel = os.path.join(channel, self.basechannel)
+        self.peers = {}
+        self.last_scan = -float('inf')
         return
 
     def start_broadcasting(self):
@@ -43,7 +72,8 @@ class MockNetwork(BaseNetwork):
         agents know where to look.
         """
         self.logname = self.basechannel.format(self.ID)
-        self.log = open(self.logname, 'w', 0)  # 0 buffsize = dont buffer
+        mode = 'a' if self.append else 'w'
+        self.log = open(self.logname, mode, 0)  # 0 buffsize = dont buffer
         return self.log
 
     def stop_broadcasting(self):
@@ -65,10 +95,17 @@ class MockNetwork(BaseNetwork):
         """
         self.log.write("#End of transmission")
         self.log.close()
+        self.peers = {}
+        self.last_scan = -float('inf')
         return
 
     # Sending methods:
 
+    def post(self, message):
+        """Write *message* into the broadcasting file."""
+        self.log.write(message)
+        return message
+
     def send_state(self, pos, heading):
         """Send string of the form:
                 "xx*x*  *y*   *heading* *time*    *ID*"
@@ -77,8 +114,7 @@ class MockNetwork(BaseNetwork):
         """
         message = "xx\t{:.5f}\t{:.5f}\t{:.5f}\t{:.5f}\t{:}\n".format(
             pos[0], pos[1], heading, time(), self.ID)
-        self.log.write(message)
-        return message
+        return self.post(message)
 
     def send_heading(self, heading):
         """Send string of the form:
@@ -87,8 +123,7 @@ class MockNetwork(BaseNetwork):
         to send if there is no other message in the stack.
         """
         message = "tt\t{:.5f}\t{:.5f}\t{:}\n".format(heading, time(), self.ID)
-        self.log.write(message)
-        return message
+        return self.post(message)
 
     def send_obstacles(self, obstacles):
         """Send string of the form:
@@ -97,34 +132,31 @@ class MockNetwork(BaseNetwork):
         (but it is not guaranteed to be sent correctly if there
         are too many).
         """
-        obstacles_str = "".join("{:.2f}:{:.2f}".format(*o) for o in obstacles)
-        message = "oo{:}{:.5f}\t{:}".format(obstacles_str, time(), self.ID)
-        self.log.write(message)
-        return message
+        obstacles_str = "".join("{:.2f}:{:.2f}\t".format(*o)
+                                for o in obstacles)
+        message = "oo{:}{:.5f}\t{:}\n".format(obstacles_str, time(), self.ID)
+        return self.post(message)
 
     def send_wakeup(self):
         """Send wakeup signal to everyone.
         Message includes the ID and the time.
         """
         message = "up\t{:.5f}\t{:}\n".format(time(), self.ID)
-        self.log.write(message)
-        return message
+        return self.post(message)
 
     def send_sleep(self):
         """Send sleep signal to everyone.
         Message includes the ID and the time.
         """
         message = "ss\t{:.5f}\t{:}\n".format(time(), self.ID)
-        self.log.write(message)
-        return message
+        return self.post(message)
 
     def send_message(self, text):
         """Sends a generic message given
         as input.
         """
         message = "mm" + str(text)
-        self.log.write(message)
-        return message
+        return self.post(message)
 
     # Processing incoming methods:
 
@@ -132,7 +164,8 @@ class MockNetwork(BaseNetwork):
         """Parse a message containing x, y, theta, time, ID"""
         try:
             x, y, theta, time, ID = message.rstrip('\n').split()
-            self.poses[ID] = (float(x), float(y), float(theta))
+            self.poses.update_agent(ID, (float(x), float(y), float(theta)),
+                                    float(time))
         except:
             sys.stderr.write("parse_position(): Bad data:\n" + message + "\n")
         return
@@ -141,7 +174,7 @@ class MockNetwork(BaseNetwork):
         """Parse a message containing theta, time, ID"""
         try:
             theta, time, ID = message.rstrip('\n').split()
-            self.poses[ID] = float(theta)
+            self.poses.update_agent(ID, float(theta), float(time))
         except:
             sys.stderr.write("parse_heading(): Bad data:\n" + message + "\n")
         return
@@ -153,6 +186,7 @@ class MockNetwork(BaseNetwork):
         try:
             data = message.rstrip('\n').split()
             ID = data.pop()
+            data.pop()  # time
             self.obstacles[ID] = [[float(x) for x in point.split(':')]
                                   for point in data]
         except:
@@ -168,38 +202,137 @@ class MockNetwork(BaseNetwork):
         return
 
     def parse_message(self, message):
-        self.inbox.append(message)
+        self.inbox.put(message)
+        return
+
+    def open_peer(self, logfile):
+        """Start following the file *logfile* of
+        another agent. Only its last *tail_size*
+        bytes are going to be read.
+        Returns the peer entry stored in self.peers:
+        [logfile, offset, unfinished line].
+        Returns None if the file cannot be used.
+        """
+        try:
+            size = os.path.getsize(logfile)
+        except OSError:
+            return None
+        offset = max(0, size - self.tail_size)
+        return [logfile, offset, None if offset else '']
+
+    def scan_peers(self):
+        """Look for the files of any agent that started
+        broadcasting since the last scan and start
+        following them. Only looks at the filesystem
+        once every *rescan_period* seconds.
+        Returns the dictionary { ID: peer entry }.
+        """
+        if time() - self.last_scan < self.rescan_period:
+            return self.peers
+        self.last_scan = time()
+        prefix, suffix = self.basechannel.split("{:}")
+        for logfile in glob.glob(self.basechannel.format("*")):
+            ID = logfile[len(prefix):len(logfile) - len(suffix)]
+            if logfile == self.logname or ID in self.peers:
+                continue
+            peer = self.open_peer(logfile)
+            if peer is not None:
+                self.peers[ID] = peer
+        return self.peers
+
+    def fetch_peer(self, peer):
+        """Read the bytes appended to the file of
+        *peer* since the last call and add them to
+        its unfinished text (peer[2]), without
+        parsing them.
+        """
+        logfile, offset, unfinished = peer
+        try:
+            with open(logfile, 'r') as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    offset, unfinished = 0, ''  # file was restarted
+                f.seek(offset)
+                data = f.read()
+        except IOError:
+            return
+        peer[1] = offset + len(data)
+        if unfinished is not None:
+            peer[2] = unfinished + data
+        elif '\n' in data:
+            # started reading in the middle of a line
+            peer[2] = data.split('\n', 1)[1]
         return
 
     def read_all(self):
-        """Read the last 5 lines broadcasted by
-        each agent and parse the contents.
+        """Read the lines broadcasted by each agent
+        since the last call and parse the contents.
         """
-        logfiles = glob.glob(self.basechannel.format("*"))
-        self.poses = {}
-        self.obstacles = {}
-        for logfile in logfiles:
-            if logfile != self.logname:
-                with open(logfile, 'r') as f:
-                    lines = f.readlines()
-                    if len(lines) > 5:
-                        lines = lines[-5:]
-                    for line in lines:
-                        try:
-                            key = line[0:2]
-                            message = line[2:]
-                        except:
-                            key = None
-                        if key in self.parser:
-                            self.parser[key](message)
+        for ID, peer in self.scan_peers().items():
+            self.fetch_peer(peer)
+            if not peer[2]:
+                continue
+            lines = peer[2].split('\n')
+            peer[2] = lines.pop()
+            for line in lines:
+                key = line[0:2]
+                if key in self.parser:
+                    self.parser[key](line[2:] + '\n')
+        return
+
+    def resume_peer(self, ID, position):
+        """Follow again the file of agent *ID* with
+        *position* = [offset, unfinished text] as saved
+        by get_state(). The unfinished text, which holds
+        the lines not parsed yet when the state was saved,
+        is kept, and only the bytes written from now on
+        are read: whatever the file holds at this point
+        was already saved in that text, or was written
+        after the state was saved.
+        Returns the peer entry stored in self.peers.
+        Returns None if the file cannot be used.
+        """
+        logfile = self.basechannel.format(ID)
+        try:
+            size = os.path.getsize(logfile)
+        except OSError:
+            return None
+        self.peers[ID] = [logfile, size, position[1]]
+        return self.peers[ID]
+
+    def get_state(self):
+        """Same as BaseNetwork.get_state, adding the
+        position reached in the file of each agent and
+        the lines sent by the agents but not parsed yet,
+        so that after set_state() every message is read
+        once, even if the files were restarted.
+        """
+        state = BaseNetwork.get_state(self)
+        for peer in self.peers.values():
+            self.fetch_peer(peer)
+        state["peers"] = dict((ID, peer[1:])
+                              for ID, peer in self.peers.items())
+        return state
+
+    def set_state(self, state, clock_offset=0.):
+        """Same as BaseNetwork.set_state, following the
+        files of the agents from the positions saved.
+        """
+        BaseNetwork.set_state(self, state, clock_offset)
+        self.peers = {}
+        for ID, position in state.get("peers", {}).items():
+            self.resume_peer(ID, position)
+        self.last_scan = -float('inf')
         return
 
-    def get_agents_state(self):
+    def get_agents_state(self, max_age=None):
         """Gathers all the agents' state.
         Returns a dictionary of the form:
           { ID: [x, y, heading] }
+        Agents whose last state was sent more than
+        *max_age* seconds ago are evicted first.
         """
         self.read_all()
+        self.poses.prune(max_age)
         return self.poses
 
     def get_obstacles(self):
@@ -211,6 +344,262 @@ class MockNetwork(BaseNetwork):
         return self.obstacles
 
     def get_messages(self):
-        incomings = list(reversed(self.inbox))
-        self.inbox = []
-        return incomings
+        """Returns all incoming messages received since
+        last call to this method, sorted from newest to
+        oldest.
+        """
+        return self.inbox.get_all()
+
+
+class MockRingNetwork(MockNetwork):
+    """Variant of MockNetwork where each agent
+    broadcasts through a memory-mapped file of
+    constant size instead of an ever growing
+    text file.
+    The file of each agent contains a header with
+    two sequence counters followed by two rings:
+    one of *ring_size* fixed-width records with
+    the state (x, y, heading, time) of the agent,
+    and one of *ring_size* fixed-width records
+    with the rest of messages, stored as text of
+    at most *message_width* characters.
+    Reading the latest state of another agent
+    is just reading the header counter and the
+    record it points to from the mapped memory,
+    with no parsing involved.
+    The file is never truncated while other agents
+    may have it mapped: a new file replaces it when
+    the agent starts broadcasting again, and it is
+    removed when the agent stops. The other agents
+    notice it in their next scan and map the new
+    file instead.
+    The state of the network (see get_state) holds
+    the contents of its own file, which are written
+    back by set_state(), so the other agents restored
+    with it find the states and messages they had not
+    read yet.
+    """
+    basechannel = "radio_{:}.ring"
+    header = struct.Struct("<QQ")  # last state seq, last message seq
+    state_record = struct.Struct("<Qdddd")  # seq, x, y, heading, time
+    message_record = struct.Struct("<QH")  # seq, length (+ text)
+
+    def __init__(self, ID=None, ring_size=8, message_width=120,
+                 rescan_period=1., inbox_size=64, channel=None,
+                 append=False):
+        MockNetwork.__init__(self, ID, inbox_size, rescan_period, channel,
+                             append)
+        self.ring_size = ring_size
+        self.message_width = message_width
+        self.message_size = self.message_record.size + message_width
+        self.states_offset = self.header.size
+        self.messages_offset = (self.states_offset +
+                                ring_size * self.state_record.size)
+        self.filesize = self.messages_offset + ring_size * self.message_size
+        self.state_seq = 0
+        self.message_seq = 0
+        self.log = None
+        return
+
+    def start_broadcasting(self):
+        """Create the file *logname* with its
+        final size and map it into memory.
+        The file is written with a temporary name
+        and then renamed, so that other agents never
+        see it incomplete and the mappings of an old
+        file with the same name remain valid.
+        """
+        self.logname = self.basechannel.format(self.ID)
+        tmpname = self.logname + ".tmp"
+        self.logfile = open(tmpname, 'w+b')
+        self.logfile.write('\x00' * self.filesize)
+        self.logfile.flush()
+        os.rename(tmpname, self.logname)
+        self.log = mmap.mmap(self.logfile.fileno(), self.filesize,
+                             access=mmap.ACCESS_WRITE)
+        self.state_seq = 0
+        self.message_seq = 0
+        return self.log
+
+    def stop_broadcasting(self):
+        """Unmap, close and remove the broadcasting
+        file, and unmap every file mapped to read
+        other agents. The agents that still have the
+        file mapped keep reading the last state sent
+        until they scan the files again.
+        """
+        self.log.close()
+        self.log = None
+        self.logfile.close()
+        try:
+            os.remove(self.logname)
+        except OSError:
+            pass
+        for ID, peer in self.peers.items():
+            peer[0].close()
+        self.peers = {}
+        self.last_scan = -float('inf')
+        return
+
+    # Sending methods:
+
+    def write_state(self, x, y, heading, t):
+        """Write a new record in the state ring
+        and then publish it by updating the
+        counter in the header.
+        """
+        self.state_seq += 1
+        offset = (self.states_offset +
+                  (self.state_seq % self.ring_size) * self.state_record.size)
+        self.state_record.pack_into(self.log, offset,
+                                    self.state_seq, x, y, heading, t)
+        self.header.pack_into(self.log, 0, self.state_seq, self.message_seq)
+        return self.state_seq
+
+    def write_message(self, message):
+        """Write *message* (truncated to *message_width*
+        characters) in the message ring and then publish
+        it by updating the counter in the header.
+        """
+        text = message[:self.message_width]
+        self.message_seq += 1
+        offset = (self.messages_offset +
+                  (self.message_seq % self.ring_size) * self.message_size)
+        self.message_record.pack_into(self.log, offset,
+                                      self.message_seq, len(text))
+        start = offset + self.message_record.size
+        self.log[start:start + len(text)] = text
+        self.header.pack_into(self.log, 0, self.state_seq, self.message_seq)
+        return self.message_seq
+
+    def send_state(self, pos, heading):
+        """Store (x, y, heading, time) in the state ring.
+        Return the same string MockNetwork would send.
+        """
+        t = time()
+        self.write_state(pos[0], pos[1], heading, t)
+        return "xx\t{:.5f}\t{:.5f}\t{:.5f}\t{:.5f}\t{:}\n".format(
+            pos[0], pos[1], heading, t, self.ID)
+
+    def post(self, message):
+        """Store any message other than the state
+        in the message ring.
+        """
+        self.write_message(message)
+        return message
+
+    # Processing incoming methods:
+
+    def open_peer(self, logfile):
+        """Map into memory the file *logfile* of
+        another agent.
+        Returns the peer entry stored in self.peers:
+        [mapping, last message read, inode of the file,
+        last state read].
+        Returns None if the file is not ready yet.
+        """
+        try:
+            with open(logfile, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size < self.filesize:
+                    return None
+                ring = mmap.mmap(f.fileno(), self.filesize,
+                                 access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            return None
+        return [ring, 0, stat.st_ino, 0]
+
+    def scan_peers(self):
+        """Same as MockNetwork.scan_peers, but first
+        forget the agents whose file was removed or
+        replaced since it was mapped, so that the new
+        file (if any) is mapped instead.
+        """
+        if time() - self.last_scan >= self.rescan_period:
+            for ID, peer in list(self.peers.items()):
+                try:
+                    inode = os.stat(self.basechannel.format(ID)).st_ino
+                except OSError:
+                    inode = None
+                if inode != peer[2]:
+                    peer[0].close()
+                    del self.peers[ID]
+        return MockNetwork.scan_peers(self)
+
+    def resume_peer(self, ID, position):
+        """Map again the file of agent *ID* and skip
+        the messages and states up to *position* = [last
+        message read, inode, last state read].
+        The file is not read yet, since the agent may be
+        restored later (see set_state). If it was not,
+        its counters restart from zero and read_all()
+        reads its file from the beginning.
+        Returns the peer entry stored in self.peers.
+        Returns None if the file is not ready.
+        """
+        peer = self.open_peer(self.basechannel.format(ID))
+        if peer is None:
+            return None
+        peer[1] = position[0]
+        if len(position) > 2:
+            peer[3] = position[2]
+        self.peers[ID] = peer
+        return peer
+
+    def get_state(self):
+        """Same as MockNetwork.get_state, adding the
+        contents of the file of this agent.
+        """
+        state = BaseNetwork.get_state(self)
+        state["peers"] = dict((ID, peer[1:])
+                              for ID, peer in self.peers.items())
+        if self.log is not None:
+            state["ring"] = self.log[:]
+        return state
+
+    def set_state(self, state, clock_offset=0.):
+        """Same as MockNetwork.set_state, writing back
+        the contents saved of the file of this agent
+        if it is broadcasting.
+        """
+        MockNetwork.set_state(self, state, clock_offset)
+        if "ring" in state and self.log is not None:
+            self.log[:] = state["ring"]
+            self.state_seq, self.message_seq = self.header.unpack_from(
+                self.log, 0)
+        return
+
+    def read_all(self):
+        """Read the latest state of every agent and
+        any message they sent since the last call.
+        The table of states is only updated when an
+        agent sent a new state.
+        """
+        for ID, peer in self.scan_peers().items():
+            ring, last_message = peer[0], peer[1]
+            state_seq, message_seq = self.header.unpack_from(ring, 0)
+            if message_seq < last_message:  # file was restarted
+                last_message = 0
+            if state_seq != peer[3]:
+                offset = (self.states_offset +
+                          (state_seq % self.ring_size) *
+                          self.state_record.size)
+                seq, x, y, heading, t = self.state_record.unpack_from(
+                    ring, offset)
+                if seq == state_seq:  # else it is being overwritten
+                    self.poses.update_agent(ID, (x, y, heading), t)
+                    peer[3] = state_seq
+            first = max(last_message + 1, message_seq - self.ring_size + 1)
+            for n in range(first, message_seq + 1):
+                offset = (self.messages_offset +
+                          (n % self.ring_size) * self.message_size)
+                seq, length = self.message_record.unpack_from(ring, offset)
+                if seq != n:
+                    continue
+                start = offset + self.message_record.size
+                line = ring[start:start + length]
+                key = line[0:2]
+                if key in self.parser:
+                    self.parser[key](line[2:])
+            peer[1] = message_seq
+        return
@@ -0,0 +1,213 @@
+from math import ceil
+import collections
+import heapq
+from Map import segment_distance
+
+
+class GridPlanner(object):
+    """Plan paths around the obstacles of a Map2D.
+    The space covered by the map is divided in square
+    cells of side *resolution*, and every cell closer
+    than *clearance* to an obstacle (a point or a wall
+    segment of the map) is blocked.
+    For each goal, the distance from every free cell
+    to the goal (moving to any of the 8 neighboring
+    cells) is computed once and cached, so that any
+    number of robots going to the same point only cost
+    one computation. Up to *max_fields* distance fields
+    are kept, the least recently used one is discarded
+    first.
+    A path is then found from any start point by
+    moving down the distance field, and simplified
+    to the few waypoints where the direction changes.
+    """
+    def __init__(self, map2d, resolution=0.1, clearance=0.2, max_fields=16):
+        self.map = map2d
+        self.resolution = float(resolution)
+        self.clearance = clearance
+        self.max_fields = max_fields
+        self.x0 = map2d.minLx
+        self.y0 = map2d.minLy
+        self.nx = max(1, int(ceil(map2d.Lx / self.resolution)))
+        self.ny = max(1, int(ceil(map2d.Ly / self.resolution)))
+        self.blocked = bytearray(self.nx * self.ny)
+        self.fields = collections.OrderedDict()
+        self.block_obstacles(map2d.obstacles)
+        self.block_segments(map2d.segments)
+        return
+
+    def block_obstacles(self, obstacles):
+        """Block every cell whose center is closer
+        than *clearance* to any of *obstacles*.
+        Cached distance fields are discarded.
+        """
+        res = self.resolution
+        reach = int(ceil(self.clearance / res))
+        c2 = self.clearance * self.clearance
+        for o in obstacles:
+            i0, j0 = self.cell_unclipped(o)
+            for j in range(max(0, j0 - reach), min(self.ny, j0 + reach + 1)):
+                y = self.y0 + (j + 0.5) * res
+                for i in range(max(0, i0 - reach),
+                               min(self.nx, i0 + reach + 1)):
+                    x = self.x0 + (i + 0.5) * res
+                    if (x - o[0])**2 + (y - o[1])**2 < c2:
+                        self.blocked[i + j * self.nx] = 1
+        self.fields.clear()
+        return self.blocked
+
+    def block_segments(self, segments):
+        """Block every cell whose center is closer
+        than *clearance* to any of the line *segments*
+        ((x1, y1), (x2, y2)).
+        Cached distance fields are discarded.
+        """
+        res = self.resolution
+        clearance = self.clearance
+        for segment in segments:
+            (x1, y1), (x2, y2) = segment
+            i0, j0 = self.cell_unclipped((min(x1, x2) - clearance,
+                                          min(y1, y2) - clearance))
+            i1, j1 = self.cell_unclipped((max(x1, x2) + clearance,
+                                          max(y1, y2) + clearance))
+            for j in range(max(0, j0), min(self.ny, j1 + 1)):
+                y = self.y0 + (j + 0.5) * res
+                for i in range(max(0, i0), min(self.nx, i1 + 1)):
+                    x = self.x0 + (i + 0.5) * res
+                    if segment_distance((x, y), segment)[0] < clearance:
+                        self.blocked[i + j * self.nx] = 1
+        self.fields.clear()
+        return self.blocked
+
+    def cell_unclipped(self, pos):
+        return (int((pos[0] - self.x0) // self.resolution),
+                int((pos[1] - self.y0) // self.resolution))
+
+    def cell(self, pos):
+        """Return the index of the cell containing *pos*,
+        or of the closest one if *pos* is out of the map.
+        """
+        i, j = self.cell_unclipped(pos)
+        i = min(max(i, 0), self.nx - 1)
+        j = min(max(j, 0), self.ny - 1)
+        return i + j * self.nx
+
+    def center(self, c):
+        """Return the (x, y) coordinates of the center of cell *c*."""
+        return (self.x0 + (c % self.nx + 0.5) * self.resolution,
+                self.y0 + (c // self.nx + 0.5) * self.resolution)
+
+    def neighbors(self, c):
+        """Yield (cell, step length) for the cells around *c*."""
+        i, j = c % self.nx, c // self.nx
+        for dj in (-1, 0, 1):
+            jj = j + dj
+            if 0 <= jj < self.ny:
+                for di in (-1, 0, 1):
+                    ii = i + di
+                    if (di or dj) and 0 <= ii < self.nx:
+                        yield ii + jj * self.nx, (1.4142135623730951
+                                                  if di and dj else 1.)
+        return
+
+    def nearest_free(self, c):
+        """Return the free cell closest to cell *c*
+        (*c* itself if it is free), or None if
+        every cell is blocked.
+        """
+        if not self.blocked[c]:
+            return c
+        seen = set([c])
+        queue = collections.deque([c])
+        while queue:
+            c = queue.popleft()
+            for n, step in self.neighbors(c):
+                if n not in seen:
+                    if not self.blocked[n]:
+                        return n
+                    seen.add(n)
+                    queue.append(n)
+        return None
+
+    def distance_field(self, goal):
+        """Return a list with the distance (in cells) from
+        each cell to the free cell closest to *goal*,
+        computed with Dijkstra's algorithm over the free
+        cells. Unreachable cells are set to infinity.
+        The field is cached for the cell of *goal*.
+        """
+        source = self.nearest_free(self.cell(goal))
+        if source in self.fields:
+            self.fields[source] = field = self.fields.pop(source)
+            return field
+        field = [float('inf')] * (self.nx * self.ny)
+        if source is not None:
+            field[source] = 0.
+            heap = [(0., source)]
+            blocked = self.blocked
+            while heap:
+                d, c = heapq.heappop(heap)
+                if d > field[c]:
+                    continue
+                for n, step in self.neighbors(c):
+                    if not blocked[n] and d + step < field[n]:
+                        field[n] = d + step
+                        heapq.heappush(heap, (d + step, n))
+        self.fields[source] = field
+        while len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
+
+    def line_of_sight(self, a, b):
+        """Return True if the segment between the centers
+        of cells *a* and *b* does not cross blocked cells.
+        """
+        (xa, ya), (xb, yb) = self.center(a), self.center(b)
+        length = max(abs(xb - xa), abs(yb - ya))
+        steps = int(2 * length / self.resolution) + 1
+        for s in range(steps + 1):
+            f = float(s) / steps
+            if self.blocked[self.cell((xa + f * (xb - xa),
+                                       ya + f * (yb - ya)))]:
+                return False
+        return True
+
+    def plan(self, start, goal, simplify=True):
+        """Return a list of waypoints going from *start*
+        to *goal* around the obstacles, ending with *goal*
+        itself. If *simplify* is True, only the waypoints
+        needed to keep a line of sight between them are
+        returned. Returns None if the goal cannot be
+        reached from *start*.
+        """
+        field = self.distance_field(goal)
+        c = self.nearest_free(self.cell(start))
+        if c is None or field[c] == float('inf'):
+            return None
+        cells = [c]
+        while field[c] > 0.:
+            c = min((field[n] + step, n) for n, step in self.neighbors(c))[1]
+            cells.append(c)
+        if simplify and len(cells) > 2:
+            kept = [cells[0]]
+            for k in range(1, len(cells) - 1):
+                if not self.line_of_sight(kept[-1], cells[k + 1]):
+                    kept.append(cells[k])
+            kept.append(cells[-1])
+            cells = kept
+        path = [self.center(c) for c in cells[1:]]
+        if path:
+            path[-1] = (goal[0], goal[1])
+        else:
+            path = [(goal[0], goal[1])]
+        return path
+
+    def path_length(self, start, goal):
+        """Return the length of the shortest path from
+        *start* to *goal* (infinity if unreachable).
+        """
+        field = self.distance_field(goal)
+        c = self.nearest_free(self.cell(start))
+        if c is None:
+            return float('inf')
+        return field[c] * self.resolution
@@ -0,0 +1,198 @@
+from time import time, sleep
+import multiprocessing
+import traceback
+import signal
+import Queue
+
+
+def run_worker(index, factory, setting, dt, args, realtime,
+               poses, ticks, running, errors):
+    """Main function of each worker process.
+    Build the robot calling *factory(setting)*, turn it
+    on and call its update method every *dt* seconds
+    until *running* is cleared. After each update, the
+    pose of the body is written in the shared array
+    *poses* and the counter in *ticks* is increased.
+    Any exception is sent to the world through *errors*.
+    The robot is turned off when the worker finishes,
+    also if it is terminated (SIGTERM) by the world.
+    """
+    signal.signal(signal.SIGTERM, stop_worker)
+    try:
+        robot = factory(setting)
+        robot.turn_on()
+        try:
+            next_time = time()
+            while running.is_set():
+                robot.update(dt, *args)
+                x, y = robot.body.get_position()
+                h = robot.body.get_heading()
+                with poses.get_lock():
+                    poses[3 * index:3 * index + 3] = [x, y, h]
+                ticks[index] += 1
+                if realtime:
+                    next_time += dt
+                    delay = next_time - time()
+                    if delay > 0.:
+                        sleep(delay)
+                    else:
+                        next_time = time()  # running late, do not catch up
+        finally:
+            robot.turn_off()
+    except Exception:
+        errors.put((index, traceback.format_exc()))
+    return
+
+
+def stop_worker(signum, frame):
+    """Signal handler of the workers, to leave run_worker
+    through its finally clauses (turning off the robot,
+    closing its files and sockets) when terminated.
+    """
+    raise SystemExit(1)
+
+
+class ProcessSwarm(object):
+    """Simulate a swarm running each robot controller
+    in its own process, as in a real deployment where
+    each robot runs its own update() loop and network
+    threads in parallel with the others.
+    Each worker builds its robot by calling
+    *factory(setting)* for one of the *settings*. The
+    factory must be a module-level function so it
+    can be sent to the worker, and it should return
+    an instance of a BaseRobot subclass with a MockBody
+    and a network that works across processes, like
+    MockRingNetwork or UDPNetwork.
+    Each worker calls robot.update(dt, *args) every *dt*
+    seconds of wall time (or as fast as possible if
+    *realtime* is False).
+    The process that creates the ProcessSwarm acts as
+    the world: it keeps the ground truth in a shared
+    memory array and can record it at any rate without
+    interfering with the workers. Note that the world
+    does not integrate the motion itself: each worker
+    moves its own MockBody and is authoritative over
+    its pose, which it writes in the array after each
+    update, so the world only samples the poses.
+    """
+    def __init__(self, factory, settings, dt, args=(), realtime=True):
+        self.factory = factory
+        self.settings = list(settings)
+        self.dt = dt
+        self.args = tuple(args)
+        self.realtime = realtime
+        self.size = len(self.settings)
+        self.poses = multiprocessing.Array('d', 3 * self.size)
+        self.ticks = multiprocessing.Array('l', self.size)
+        self.running = multiprocessing.Event()
+        self.errors = multiprocessing.Queue()
+        self.failures = {}
+        self.workers = []
+        return
+
+    def start(self):
+        """Launch one worker process per robot.
+        This method does nothing if the workers
+        are already running.
+        """
+        if not self.running.is_set():
+            self.running.set()
+            self.workers = []
+            for index, setting in enumerate(self.settings):
+                worker = multiprocessing.Process(
+                    target=run_worker,
+                    args=(index, self.factory, setting, self.dt, self.args,
+                          self.realtime, self.poses, self.ticks,
+                          self.running, self.errors))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        return self.workers
+
+    def stop(self, timeout=10):
+        """Ask the workers to turn off their robots
+        and wait until they finish. Workers still
+        alive after *timeout* seconds are terminated,
+        which makes them turn off their robots too.
+        Returns the failures reported by the workers.
+        """
+        if self.running.is_set():
+            self.running.clear()
+            end_time = time() + timeout
+            for worker in self.workers:
+                worker.join(max(0., end_time - time()))
+            stuck = [worker for worker in self.workers if worker.is_alive()]
+            for worker in stuck:
+                worker.terminate()
+            for worker in stuck:
+                worker.join(timeout)
+        self.collect_errors()
+        return self.failures
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        return
+
+    def collect_errors(self):
+        """Gather the tracebacks sent by the workers
+        into self.failures = { index: traceback }.
+        """
+        while True:
+            try:
+                index, error = self.errors.get_nowait()
+            except Queue.Empty:
+                break
+            self.failures[index] = error
+        return self.failures
+
+    def get_poses(self):
+        """Return the ground truth as a list
+        with the (x, y, heading) of each robot.
+        """
+        with self.poses.get_lock():
+            p = self.poses[:]
+        return [tuple(p[3 * i:3 * i + 3]) for i in range(self.size)]
+
+    def get_ticks(self):
+        """Return the number of updates performed
+        by each robot so far.
+        """
+        return self.ticks[:]
+
+    def run(self, total_time, record_dt=None, callback=None, metrics=None):
+        """Run the swarm for *total_time* seconds.
+        Every *record_dt* seconds (default: dt) the
+        world calls callback(t, poses) with the
+        time since the start and the ground truth,
+        and updates *metrics* (a SwarmMetrics) with it.
+        Stops early if every worker has died.
+        Returns the failures reported by the workers.
+        """
+        if record_dt is None:
+            record_dt = self.dt
+        self.start()
+        try:
+            init_time = time()
+            next_time = init_time
+            while time() - init_time < total_time:
+                if callback is not None or metrics is not None:
+                    t = time() - init_time
+                    poses = self.get_poses()
+                    if metrics is not None:
+                        metrics.update_poses(poses, t)
+                    if callback is not None:
+                        callback(t, poses)
+                if not any(worker.is_alive() for worker in self.workers):
+                    break
+                next_time += record_dt
+                delay = next_time - time()
+                if delay > 0.:
+                    sleep(delay)
+        finally:
+            self.stop()
+        return self.failures
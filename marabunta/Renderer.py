@@ -0,0 +1,275 @@
+from math import sin, cos
+import multiprocessing
+import traceback
+import Queue
+import sys
+import matplotlib
+
+
+class Renderer(object):
+    """Draw the state of a simulated swarm with matplotlib.
+    The figure and its artists are created once and only
+    their data is updated on each frame, so drawing a new
+    frame does not rebuild the plot. When shown on screen,
+    only the robots are redrawn over a cached background
+    (blitting) if the backend supports it.
+    *obstacles* can be a Map2D instance or a list of
+    (x, y) points, drawn once as the static background
+    together with the walls of the map (or *segments*).
+    The limits of the plot are given by *bounds* =
+    (x0, xf, y0, yf), or taken from the map, or from
+    the first frame if neither is given.
+    If *show* is False, nothing is shown on screen
+    and matplotlib runs headless (Agg backend).
+    If *output* is given, each frame drawn is saved:
+    if it contains a format field (e.g. "frame_%05d.png")
+    as a sequence of images, else as a video file written
+    by matplotlib's *writer* (ffmpeg by default) at *fps*
+    frames per second.
+    Only one out of *every* calls to draw() is drawn,
+    to decimate the frames of long simulations.
+    """
+    def __init__(self, obstacles=None, bounds=None, output=None, show=True,
+                 every=1, fps=10, dpi=100, size=(6, 6), writer="ffmpeg",
+                 heading_length=0.15, segments=None):
+        if not show and 'matplotlib.pyplot' not in sys.modules:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+        self.plt = plt
+        self.output = output
+        self.show = show
+        self.every = max(1, int(every))
+        self.dpi = dpi
+        self.heading_length = heading_length
+        self.calls = 0
+        self.frames = 0
+        self.fig = plt.figure(figsize=size)
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_aspect('equal')
+        points = getattr(obstacles, 'obstacles', obstacles)
+        if bounds is None and hasattr(obstacles, 'minLx'):
+            bounds = (obstacles.minLx, obstacles.maxLx,
+                      obstacles.minLy, obstacles.maxLy)
+        self.bounds = bounds
+        if bounds is not None:
+            self.set_bounds(bounds)
+        if points is not None and len(points):
+            self.ax.plot([o[0] for o in points], [o[1] for o in points],
+                         'gs', markersize=6.)
+        if segments is None:
+            segments = getattr(obstacles, 'segments', None)
+        if segments:
+            self.ax.add_collection(LineCollection(segments, colors='g',
+                                                  linewidths=2.))
+        # Artists updated on every frame. Animated artists are
+        # left out of full redraws, so they can only be used
+        # for blitting when the frames are not saved:
+        self.animated = (show and output is None and
+                         getattr(self.fig.canvas, 'supports_blit', False))
+        self.robots, = self.ax.plot([], [], 'ro', animated=self.animated)
+        self.headings = LineCollection([], colors='r',
+                                       animated=self.animated)
+        self.ax.add_collection(self.headings)
+        self.clock = self.ax.text(0.02, 0.97, '', va='top',
+                                  transform=self.ax.transAxes,
+                                  animated=self.animated)
+        self.background = None
+        self.writer = None
+        if output is not None and '%' not in output:
+            from matplotlib import animation
+            self.writer = animation.writers[writer](fps=fps)
+            self.writer.setup(self.fig, output, dpi)
+        if show:
+            plt.show(block=False)
+        return
+
+    def set_bounds(self, bounds):
+        """Fix the limits of the plot to
+        *bounds* = (x0, xf, y0, yf).
+        """
+        self.bounds = bounds
+        self.ax.set_xlim(bounds[0], bounds[1])
+        self.ax.set_ylim(bounds[2], bounds[3])
+        self.background = None
+        return
+
+    def draw(self, poses, t=None):
+        """Draw a frame with the robots at *poses*, a list
+        of (x, y, heading), and the time *t* if given.
+        Return True if the frame was drawn, False if
+        it was skipped by the decimation.
+        """
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return False
+        xs = [p[0] for p in poses]
+        ys = [p[1] for p in poses]
+        if self.bounds is None and len(poses):
+            margin = 0.1 * max(max(xs) - min(xs), max(ys) - min(ys), 1.)
+            self.set_bounds((min(xs) - margin, max(xs) + margin,
+                             min(ys) - margin, max(ys) + margin))
+        L = self.heading_length
+        self.robots.set_data(xs, ys)
+        self.headings.set_segments([[(p[0], p[1]),
+                                     (p[0] + L * cos(p[2]),
+                                      p[1] + L * sin(p[2]))] for p in poses])
+        self.clock.set_text('' if t is None else 't = %.1f' % t)
+        if self.show:
+            self.blit()
+        if self.writer is not None:
+            self.writer.grab_frame()
+        elif self.output is not None:
+            self.fig.savefig(self.output % self.frames, dpi=self.dpi)
+        self.frames += 1
+        return True
+
+    def close(self):
+        """Finish writing the video file (if any)
+        and close the figure.
+        """
+        if self.writer is not None:
+            self.writer.finish()
+            self.writer = None
+        self.plt.close(self.fig)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return
+
+# User should not need to call any function below this point
+
+    def blit(self):
+        """Update the robots on screen. If possible,
+        restore the cached background and redraw
+        only the animated artists.
+        """
+        canvas = self.fig.canvas
+        if not self.animated:
+            canvas.draw_idle()
+            self.plt.pause(1e-6)
+            return
+        if self.background is None:
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.ax.bbox)
+        canvas.restore_region(self.background)
+        for artist in (self.robots, self.headings, self.clock):
+            self.ax.draw_artist(artist)
+        canvas.blit(self.ax.bbox)
+        canvas.flush_events()
+        return
+
+
+def run_renderer(frames, settings, errors):
+    """Main function of the process started by
+    RenderProcess. Build a Renderer with *settings*
+    and draw the frames received through *frames*
+    until None is received.
+    """
+    try:
+        renderer = Renderer(**settings)
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                renderer.draw(*frame)
+        finally:
+            renderer.close()
+    except Exception:
+        errors.put(traceback.format_exc())
+    return
+
+
+class RenderProcess(object):
+    """Run a Renderer in a separate process, so that
+    drawing (or encoding a video) does not slow down
+    the simulation. The arguments are the same as
+    for Renderer.
+    The frames are sent through a queue of at most
+    *queue_size* frames. If the renderer cannot keep
+    up and the queue is full, new frames are dropped
+    instead of waiting, and counted in self.dropped.
+    Decimation (*every*) is applied before sending,
+    so skipped frames are never copied to the queue.
+    """
+    def __init__(self, obstacles=None, bounds=None, output=None, show=True,
+                 every=1, queue_size=8, **kws):
+        points = getattr(obstacles, 'obstacles', obstacles)
+        if bounds is None and hasattr(obstacles, 'minLx'):
+            bounds = (obstacles.minLx, obstacles.maxLx,
+                      obstacles.minLy, obstacles.maxLy)
+        kws.setdefault('segments', getattr(obstacles, 'segments', None))
+        self.settings = dict(kws, obstacles=points, bounds=bounds,
+                             output=output, show=show, every=1)
+        self.every = max(1, int(every))
+        self.calls = 0
+        self.dropped = 0
+        self.frames = multiprocessing.Queue(queue_size)
+        self.errors = multiprocessing.Queue()
+        self.process = None
+        return
+
+    def start(self):
+        """Launch the render process. This method
+        does nothing if it is already running.
+        """
+        if self.process is None:
+            self.process = multiprocessing.Process(
+                target=run_renderer,
+                args=(self.frames, self.settings, self.errors))
+            self.process.daemon = True
+            self.process.start()
+        return self.process
+
+    def draw(self, poses, t=None):
+        """Send a frame with the robots at *poses*, a list
+        of (x, y, heading), and the time *t* to the render
+        process. Return True if the frame was sent, False if
+        it was skipped by the decimation or dropped.
+        """
+        self.start()
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return False
+        try:
+            self.frames.put_nowait(([tuple(p) for p in poses], t))
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self, timeout=60):
+        """Wait until the render process draws the
+        frames in the queue and finishes (writing
+        the video file if any). Raise an Exception
+        with its traceback if the renderer failed.
+        """
+        if self.process is not None:
+            try:
+                self.frames.put(None, True, timeout)
+            except Queue.Full:
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        try:
+            error = self.errors.get_nowait()
+        except Queue.Empty:
+            error = None
+        if error is not None:
+            raise Exception("RenderProcess: renderer failed\n" + error)
+        return
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return
@@ -0,0 +1,322 @@
+from math import pi, sqrt, sin, cos
+import importlib
+import tempfile
+import shutil
+import random
+import json
+import sys
+import os
+import marabunta
+import marabunta.models
+from Map import Map2D, RobotMap
+from SwarmMetrics import SwarmMetrics
+from Checkpoint import save_checkpoint, load_checkpoint
+from MockNetwork import MockNetwork
+
+
+class Scenario(object):
+    """Simulation described by a dictionary *data*,
+    usually loaded from a JSON file with from_file().
+    The keys of the dictionary are:
+        "model": name of the robot class, either one in
+            marabunta.models or "module.Class" (the
+            module is searched in *basedir* too).
+        "parameters": keyword arguments of the model,
+            after body and network.
+        "body": {"class": "MockBody", ...} with the
+            keyword arguments of the body.
+        "network": {"class": "MockNetwork", ...} with
+            the keyword arguments of the network. Unless
+            a "channel" is given, each run of a MockNetwork
+            scenario broadcasts in a new directory, removed
+            when the run ends.
+        "map": {"file": ..., "radius": 0.5,
+            "field_resolution": null} with the obstacles,
+            shared by all the bodies (optional).
+        "robot_sensing": {"cell_size": 1.4,
+            "body_radius": 0.} to let the bodies detect
+            each other as obstacles (optional, only
+            for bodies with load_robots, e.g. MockBody).
+        "collisions": {"radius": 0.1, "iterations": 4}
+            to keep the bodies from overlapping after
+            every tick (optional, requires numpy and
+            bodies with a *pos* list, e.g. MockBody).
+        "integrator": {"substeps": 1, "max_accel": null}
+            to move all the bodies at once at the end of
+            every tick, along exact arcs (optional,
+            requires numpy and MockBody bodies).
+        "robots": either a list of
+            {"ID": ..., "position": [x, y], "heading": h}
+            or {"count": N, "position": ..., "heading": ...}
+            where position can be a point or a distribution
+            {"distribution": "disk", "center": [x, y],
+            "radius": r} or {"distribution": "box",
+            "min": [x0, y0], "max": [x1, y1]}, and heading
+            a value or {"distribution": "uniform",
+            "min": h0, "max": h1}.
+        "seed": seed of the random number generator.
+        "dt", "duration": time step and total time
+            (simulated, the runner does not wait).
+        "update_args": extra arguments of robot.update
+            after dt (e.g. [speed]).
+        "output": {"trajectory": file, "metrics": file,
+            "summary": file, "every": ticks between
+            records, "checkpoint": file,
+            "checkpoint_every": ticks between
+            checkpoints} (all optional).
+    Relative file names are taken from *basedir*.
+    """
+    defaults = {"parameters": {},
+                "body": {"class": "MockBody"},
+                "network": {"class": "MockNetwork"},
+                "map": None,
+                "robot_sensing": None,
+                "collisions": None,
+                "integrator": None,
+                "seed": None,
+                "dt": 0.1,
+                "duration": 10.,
+                "update_args": [],
+                "output": {}}
+
+    def __init__(self, data, basedir="."):
+        self.data = dict(self.defaults)
+        self.data.update(data)
+        if "model" not in self.data or "robots" not in self.data:
+            raise Exception("Scenario: 'model' and 'robots' are required")
+        self.basedir = basedir
+        self.robots = []
+        self.channel = None
+        self.map = None
+        self.robot_map = None
+        self.collisions = None
+        self.integrator = None
+        self.metrics = None
+        self.t = 0.
+        self.ticks = 0
+        return
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load a scenario from a JSON file (or YAML
+        if the name ends in .yaml or .yml and PyYAML
+        is installed).
+        """
+        with open(filename, 'r') as f:
+            if filename.endswith((".yaml", ".yml")):
+                import yaml
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        return cls(data, os.path.dirname(os.path.abspath(filename)))
+
+    def path(self, filename):
+        """Return *filename* relative to basedir."""
+        return os.path.join(self.basedir, filename)
+
+    def build(self, resume=False):
+        """Create the map and the robots of the scenario
+        and turn them on. If *resume* is True, the robots
+        are going to be restored from a checkpoint, so
+        the files of a MockNetwork channel given in the
+        scenario are not emptied.
+        Return the list of robots.
+        """
+        if self.data["seed"] is not None:
+            random.seed(self.data["seed"])
+        model = self.find_class(self.data["model"], marabunta.models)
+        body_kws = dict(self.data["body"])
+        body_class = self.find_class(body_kws.pop("class"), marabunta)
+        network_kws = dict(self.data["network"])
+        network_class = self.find_class(network_kws.pop("class"), marabunta)
+        if issubclass(network_class, MockNetwork):
+            if "channel" in network_kws:
+                network_kws["channel"] = self.path(network_kws["channel"])
+                network_kws.setdefault("append", resume)
+            else:
+                self.channel = tempfile.mkdtemp(prefix="radio_",
+                                                dir=self.basedir)
+                network_kws["channel"] = self.channel
+        if self.data["map"]:
+            map_kws = dict(self.data["map"])
+            self.map = Map2D(self.path(map_kws.pop("file")),
+                             map_kws.pop("radius", 0.5), **map_kws)
+        if self.data["robot_sensing"] is not None:
+            self.robot_map = RobotMap(**self.data["robot_sensing"])
+        if self.data["collisions"] is not None:
+            from Collisions import CollisionSolver
+            self.collisions = CollisionSolver(**self.data["collisions"])
+        if self.data["integrator"] is not None:
+            from Unicycle import UnicycleIntegrator
+            self.integrator = UnicycleIntegrator(**self.data["integrator"])
+        self.robots = []
+        for setting in self.robot_settings():
+            body = body_class(setting["position"], setting["heading"],
+                              **body_kws)
+            if self.map is not None:
+                body.load_obstacles(self.map)
+            if self.robot_map is not None:
+                body.load_robots(self.robot_map)
+            if self.integrator is not None:
+                self.integrator.track(body)
+            network = network_class(setting["ID"], **network_kws)
+            self.robots.append(model(body, network,
+                                     **self.data["parameters"]))
+        for robot in self.robots:
+            robot.turn_on()
+        return self.robots
+
+    def robot_settings(self):
+        """Return a list of {"ID", "position", "heading"}
+        with the initial conditions of each robot,
+        drawing them from the distributions if needed.
+        """
+        robots = self.data["robots"]
+        if isinstance(robots, list):
+            return [{"ID": r.get("ID", "R%03i" % i),
+                     "position": self.draw(r["position"]),
+                     "heading": self.draw(r.get("heading", 0.))}
+                    for i, r in enumerate(robots)]
+        id_format = robots.get("id_format", "R%03i")
+        return [{"ID": id_format % i,
+                 "position": self.draw(robots["position"]),
+                 "heading": self.draw(robots.get("heading", 0.))}
+                for i in range(robots["count"])]
+
+    def run(self, resume=False):
+        """Build the robots (if not built yet) and update
+        them every dt until the duration is reached,
+        recording the outputs. If *resume* is True and
+        the checkpoint file exists, the simulation
+        continues from it, and the records written after
+        the checkpoint are removed from the outputs
+        before appending the new ones.
+        Return the summary of the metrics.
+        """
+        output = self.data["output"]
+        dt = self.data["dt"]
+        args = self.data["update_args"]
+        every = output.get("every", 1)
+        checkpoint = output.get("checkpoint")
+        checkpoint_every = output.get("checkpoint_every")
+        restore = bool(resume and checkpoint and
+                       os.path.exists(self.path(checkpoint)))
+        if not self.robots:
+            self.build(restore)
+        self.metrics = SwarmMetrics(len(self.robots), self.map)
+        sizes = {}
+        if restore:
+            self.t, extra = load_checkpoint(self.path(checkpoint),
+                                            self.robots)
+            self.ticks, self.metrics = extra["ticks"], extra["metrics"]
+            sizes = extra.get("outputs", {})
+        files = {}
+        try:
+            for key in ("trajectory", "metrics"):
+                if key in output:
+                    files[key] = self.open_output(output[key], restore,
+                                                  sizes.get(key))
+            while self.t < self.data["duration"] - 1e-9:
+                if self.robot_map is not None:
+                    self.robot_map.update()
+                for robot in self.robots:
+                    if robot.is_working():
+                        robot.update(dt, *args)
+                if self.integrator is not None:
+                    self.integrator.step(dt)
+                if self.collisions is not None:
+                    self.collisions.step([robot.body
+                                          for robot in self.robots])
+                self.t += dt
+                self.ticks += 1
+                if self.ticks % every == 0:
+                    self.record(files)
+                if checkpoint and checkpoint_every and \
+                        self.ticks % checkpoint_every == 0:
+                    for f in files.values():
+                        f.flush()
+                    outputs = dict((key, f.tell())
+                                   for key, f in files.items())
+                    save_checkpoint(self.path(checkpoint), self.robots,
+                                    self.t, {"ticks": self.ticks,
+                                             "metrics": self.metrics,
+                                             "outputs": outputs})
+        finally:
+            for f in files.values():
+                f.close()
+            for robot in self.robots:
+                robot.turn_off()
+            if self.channel is not None:
+                shutil.rmtree(self.channel, True)
+                self.channel = None
+        summary = self.metrics.summary()
+        if "summary" in output:
+            with open(self.path(output["summary"]), 'w') as f:
+                json.dump(summary, f, indent=2)
+        return summary
+
+# User should not need to call any function below this point
+
+    def open_output(self, filename, restore=False, size=None):
+        """Open the output file *filename* to write the
+        records. If *restore* is True, the simulation was
+        restored from a checkpoint: the file is cut back
+        to the *size* it had when the checkpoint was saved
+        (if known) and the new records are appended.
+        """
+        if not restore:
+            return open(self.path(filename), 'w')
+        f = open(self.path(filename), 'a')
+        if size is not None and size <= os.fstat(f.fileno()).st_size:
+            f.truncate(size)
+        return f
+
+    def record(self, files):
+        """Update the metrics and write the
+        current state in the output files.
+        """
+        poses = [(robot.body.get_position()[0],
+                  robot.body.get_position()[1],
+                  robot.body.get_heading()) for robot in self.robots]
+        self.metrics.update_poses(poses, self.t)
+        if "trajectory" in files:
+            files["trajectory"].write("".join(
+                "%.3f\t%s\t%.5f\t%.5f\t%.5f\n" %
+                (self.t, robot.network.ID, p[0], p[1], p[2])
+                for robot, p in zip(self.robots, poses)))
+        if "metrics" in files:
+            m = self.metrics
+            files["metrics"].write("%.3f\t%.5f\t%.5f\t%.5f\t%.5f\n" % (
+                self.t, m.polarization, m.nn_mean, m.hull_area,
+                m.coverage_fraction()))
+        return
+
+    def find_class(self, name, package):
+        """Return the class called *name* in *package*,
+        or in the module given as "module.Class".
+        """
+        if "." not in name:
+            return getattr(package, name)
+        module, name = name.rsplit(".", 1)
+        if self.basedir not in sys.path:
+            sys.path.insert(0, self.basedir)
+        return getattr(importlib.import_module(module), name)
+
+    def draw(self, value):
+        """Return *value*, or a random value drawn from
+        it if it is a distribution (see the class doc).
+        """
+        if not isinstance(value, dict):
+            return value
+        kind = value["distribution"]
+        if kind == "uniform":
+            return random.uniform(value["min"], value["max"])
+        elif kind == "box":
+            return [random.uniform(value["min"][0], value["max"][0]),
+                    random.uniform(value["min"][1], value["max"][1])]
+        elif kind == "disk":
+            r = value["radius"] * sqrt(random.random())
+            theta = 2. * pi * random.random()
+            return [value["center"][0] + r * cos(theta),
+                    value["center"][1] + r * sin(theta)]
+        raise Exception("Scenario: unknown distribution {:}".format(kind))
@@ -0,0 +1,180 @@
+from time import time, sleep
+import threading
+import traceback
+
+
+class SwarmExecutor(object):
+    """Step several robots controlled from the same
+    host concurrently.
+    Each robot in *robots* gets its own worker thread,
+    so that a robot blocked in its body (e.g. an eBotBody
+    sleeping while the wheels move) does not delay the
+    others. Calling step(*args) runs robot.update(*args)
+    for every robot at the same time and returns when all
+    of them are done (barrier-style tick) or after
+    *timeout* seconds, if given.
+    A robot raising an exception is turned off and left
+    out of the following ticks, without affecting the
+    rest of the swarm. Its traceback is stored in
+    self.failures = { index: traceback }.
+    A robot still busy from a previous tick (because it
+    exceeded the timeout) skips the ticks until it is
+    done.
+    If a RobotMap is given as *robot_map*, the positions
+    of its bodies are updated at the start of every tick,
+    before the robots sense each other.
+    """
+    def __init__(self, robots, timeout=None, robot_map=None):
+        self.robots = list(robots)
+        self.timeout = timeout
+        self.robot_map = robot_map
+        self.size = len(self.robots)
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.jobs = [0] * self.size
+        self.done = [0] * self.size
+        self.results = [None] * self.size
+        self.pending = set()
+        self.args = ()
+        self.kws = {}
+        self.failures = {}
+        self.active = False
+        self.threads = []
+        return
+
+    def start(self):
+        """Start one worker thread per robot.
+        This method does nothing if the workers
+        are already running.
+        """
+        if not self.active:
+            self.active = True
+            self.threads = []
+            for index in range(self.size):
+                thread = threading.Thread(target=self.work, args=(index,))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return self.threads
+
+    def stop(self, timeout=10):
+        """Stop the worker threads once they finish
+        their current update. Raise an Exception if
+        some thread does not finish in *timeout* seconds.
+        """
+        if self.active:
+            with self.condition:
+                self.active = False
+                self.condition.notify_all()
+            for thread in self.threads:
+                thread.join(timeout)
+            if any(thread.is_alive() for thread in self.threads):
+                raise Exception("SwarmExecutor: Could not stop workers")
+        return
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        return
+
+    def healthy(self):
+        """Return the indexes of the robots that
+        have not failed.
+        """
+        return [i for i in range(self.size) if i not in self.failures]
+
+    def step(self, *args, **kws):
+        """Run robot.update(*args, **kws) for all the
+        healthy robots concurrently and wait until all
+        of them are done or the timeout is reached.
+        Returns a list with the value returned by
+        each update (None for the robots that failed,
+        were busy, or did not finish in time).
+        """
+        self.start()
+        if self.robot_map is not None:
+            self.robot_map.update()
+        with self.condition:
+            self.generation += 1
+            self.args = args
+            self.kws = kws
+            self.results = [None] * self.size
+            self.pending = set()
+            for i in self.healthy():
+                if self.jobs[i] == self.done[i]:  # not busy
+                    self.jobs[i] = self.generation
+                    self.pending.add(i)
+            self.condition.notify_all()
+            if self.timeout is None:
+                while self.pending:
+                    self.condition.wait()
+            else:
+                end_time = time() + self.timeout
+                while self.pending:
+                    remaining = end_time - time()
+                    if remaining <= 0.:
+                        break
+                    self.condition.wait(remaining)
+            results = self.results[:]
+        return results
+
+    def run(self, total_time, dt, *args, **kws):
+        """Call step(dt, *args, **kws) once every *dt*
+        seconds during *total_time* seconds, or until
+        every robot has failed.
+        Returns the number of ticks performed.
+        """
+        ticks = 0
+        end_time = time() + total_time
+        next_time = time()
+        while time() < end_time and self.healthy():
+            self.step(dt, *args, **kws)
+            ticks += 1
+            next_time += dt
+            delay = next_time - time()
+            if delay > 0.:
+                sleep(delay)
+            else:
+                next_time = time()
+        return ticks
+
+# User should not need to call any function below this point
+
+    def work(self, index):
+        """Function meant to be called in a separate
+        thread to update robot number *index* every
+        time a new tick is assigned to it.
+        """
+        robot = self.robots[index]
+        while True:
+            with self.condition:
+                while self.active and self.jobs[index] == self.done[index]:
+                    self.condition.wait()
+                if not self.active:
+                    return
+                job = self.jobs[index]
+                args, kws = self.args, self.kws
+            failed = False
+            try:
+                result = robot.update(*args, **kws)
+            except Exception:
+                result = None
+                failed = True
+                error = traceback.format_exc()
+                try:
+                    robot.turn_off()
+                except Exception:
+                    error += traceback.format_exc()
+            with self.condition:
+                self.done[index] = job
+                if failed:
+                    self.failures[index] = error
+                if job == self.generation:
+                    self.results[index] = result
+                    self.pending.discard(index)
+                self.condition.notify_all()
+            if failed:
+                return
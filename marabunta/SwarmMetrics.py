@@ -0,0 +1,228 @@
+from math import sin, cos, sqrt
+from array import array
+from Map import SpatialHash
+
+
+class SwarmMetrics(object):
+    """Measure the collective state of a swarm of *size*
+    robots while it is being simulated.
+    Every call to update(positions, headings, t) reads
+    the position and heading of every robot and updates:
+        self.polarization: order parameter of the headings,
+            |sum_i (cos h_i, sin h_i)| / N, between 0 and 1.
+        self.nn_mean: mean distance to the nearest neighbor.
+        self.nn_histogram: number of robots whose nearest
+            neighbor is in each of *bins* intervals of
+            width *nn_max*/*bins* (the last one also
+            counts the robots farther than *nn_max*).
+        self.hull_area: area of the convex hull of the
+            positions.
+        self.covered: number of boxes of the grid of
+            *map2d* (if given) visited by any robot so far,
+            with self.coverage the bitmap of visited boxes.
+        self.consensus_time: time since which the
+            polarization is above *consensus_threshold*,
+            or None if it is not.
+    The values of the last *history* ticks are also kept
+    in self.times, self.polarizations, self.nn_means and
+    self.hull_areas, used as ring buffers.
+    All the storage is allocated when the instance is
+    created and reused on every tick. The robots are
+    kept in the order of the previous tick to compute
+    the convex hull, so re-sorting them costs O(N)
+    when they move little between ticks.
+    """
+    def __init__(self, size, map2d=None, consensus_threshold=0.95,
+                 bins=20, nn_max=2., cell_size=1., history=1024):
+        self.size = size
+        self.map = map2d
+        self.consensus_threshold = consensus_threshold
+        self.bins = bins
+        self.nn_max = float(nn_max)
+        self.ticks = 0
+        self.time = None
+        # Current values
+        self.polarization = 0.
+        self.nn_mean = 0.
+        self.nn_histogram = array('l', [0]) * bins
+        self.hull_area = 0.
+        self.consensus_time = None
+        # Coverage of the Map2D grid
+        if map2d is not None:
+            self.coverage = bytearray(map2d.nx * map2d.ny)
+        else:
+            self.coverage = bytearray()
+        self.covered = 0
+        # History
+        self.history = history
+        self.times = array('d', [0.]) * history
+        self.polarizations = array('d', [0.]) * history
+        self.nn_means = array('d', [0.]) * history
+        self.hull_areas = array('d', [0.]) * history
+        # Work space
+        self.index = SpatialHash(cell_size)
+        self.xs = array('d', [0.]) * size
+        self.ys = array('d', [0.]) * size
+        self.order = list(range(size))
+        self.hull = [0] * (2 * size + 1)
+        return
+
+    def update(self, positions, headings, t=None):
+        """Update the metrics with the *positions* (x, y)
+        and *headings* of the robots at time *t* (by
+        default, the number of ticks so far).
+        Return the polarization.
+        """
+        if t is None:
+            t = float(self.ticks)
+        xs, ys = self.xs, self.ys
+        for i in range(self.size):
+            xs[i] = positions[i][0]
+            ys[i] = positions[i][1]
+        self.time = t
+        self.update_polarization(headings, t)
+        self.update_neighbors()
+        self.update_hull()
+        self.update_coverage()
+        k = self.ticks % self.history
+        self.times[k] = t
+        self.polarizations[k] = self.polarization
+        self.nn_means[k] = self.nn_mean
+        self.hull_areas[k] = self.hull_area
+        self.ticks += 1
+        return self.polarization
+
+    def update_poses(self, poses, t=None):
+        """Same as update but taking a list of (x, y,
+        heading), as given by ProcessSwarm.get_poses().
+        """
+        return self.update(poses, [p[2] for p in poses], t)
+
+    def coverage_fraction(self):
+        """Return the fraction of the boxes
+        of the map visited so far.
+        """
+        if not self.coverage:
+            return 0.
+        return float(self.covered) / len(self.coverage)
+
+    def summary(self):
+        """Return a dictionary with the current
+        value of every metric.
+        """
+        return {"time": self.time,
+                "ticks": self.ticks,
+                "polarization": self.polarization,
+                "nn_mean": self.nn_mean,
+                "nn_histogram": list(self.nn_histogram),
+                "hull_area": self.hull_area,
+                "coverage": self.coverage_fraction(),
+                "consensus_time": self.consensus_time}
+
+    def reset_coverage(self):
+        for i in range(len(self.coverage)):
+            self.coverage[i] = 0
+        self.covered = 0
+        return
+
+# User should not need to call any function below this point
+
+    def update_polarization(self, headings, t):
+        """Compute the order parameter of *headings*
+        and keep track of the time of consensus.
+        """
+        sx = sy = 0.
+        for h in headings:
+            sx += cos(h)
+            sy += sin(h)
+        if self.size:
+            self.polarization = sqrt(sx * sx + sy * sy) / self.size
+        if self.polarization >= self.consensus_threshold:
+            if self.consensus_time is None:
+                self.consensus_time = t
+        else:
+            self.consensus_time = None
+        return self.polarization
+
+    def update_neighbors(self):
+        """Find the nearest neighbor of each robot using
+        a SpatialHash and fill the histogram of distances.
+        """
+        xs, ys = self.xs, self.ys
+        histogram = self.nn_histogram
+        for b in range(self.bins):
+            histogram[b] = 0
+        for i in range(self.size):
+            self.index.insert(i, (xs[i], ys[i]))
+        total = 0.
+        width = self.nn_max / self.bins
+        for i in range(self.size):
+            found = self.index.nearest((xs[i], ys[i]), 2)
+            if len(found) < 2:
+                continue
+            d = sqrt(found[1][0])
+            total += d
+            histogram[min(int(d / width), self.bins - 1)] += 1
+        self.nn_mean = total / self.size if self.size > 1 else 0.
+        return self.nn_mean
+
+    def update_hull(self):
+        """Compute the area of the convex hull with
+        Andrew's monotone chain, after re-sorting
+        self.order by insertion (linear time if the
+        order barely changed since the last tick).
+        """
+        xs, ys, order, hull = self.xs, self.ys, self.order, self.hull
+        for k in range(1, self.size):
+            i = order[k]
+            key = (xs[i], ys[i])
+            m = k - 1
+            while m >= 0 and (xs[order[m]], ys[order[m]]) > key:
+                order[m + 1] = order[m]
+                m -= 1
+            order[m + 1] = i
+        if self.size < 3:
+            self.hull_area = 0.
+            return self.hull_area
+
+        def turn(a, b, c):
+            return ((xs[b] - xs[a]) * (ys[c] - ys[a]) -
+                    (ys[b] - ys[a]) * (xs[c] - xs[a]))
+        top = 0
+        for i in order:  # lower hull
+            while top >= 2 and turn(hull[top - 2], hull[top - 1], i) <= 0:
+                top -= 1
+            hull[top] = i
+            top += 1
+        lower = top + 1
+        for k in range(self.size - 2, -1, -1):  # upper hull
+            i = order[k]
+            while top >= lower and turn(hull[top - 2], hull[top - 1], i) <= 0:
+                top -= 1
+            hull[top] = i
+            top += 1
+        # hull[0:top] is closed (first point repeated at the end)
+        area = 0.
+        for k in range(top - 1):
+            a, b = hull[k], hull[k + 1]
+            area += xs[a] * ys[b] - xs[b] * ys[a]
+        self.hull_area = 0.5 * abs(area)
+        return self.hull_area
+
+    def update_coverage(self):
+        """Mark the boxes of the map grid
+        that contain a robot as visited.
+        """
+        m = self.map
+        if m is None:
+            return self.covered
+        xs, ys, coverage = self.xs, self.ys, self.coverage
+        for k in range(self.size):
+            u = (xs[k] - m.minLx) * m.nx / m.Lx
+            v = (ys[k] - m.minLy) * m.ny / m.Ly
+            if 0. <= u < m.nx and 0. <= v < m.ny:
+                c = int(u) + int(v) * m.nx
+                if not coverage[c]:
+                    coverage[c] = 1
+                    self.covered += 1
+        return self.covered
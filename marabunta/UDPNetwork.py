@@ -0,0 +1,157 @@
+import threading
+import socket
+import select
+import errno
+from BroadcastNetwork import BroadcastNetwork
+
+
+class UDPNetwork(BroadcastNetwork):
+    """Network class for communication using UDP multicast.
+    Every agent joins the multicast *group* on *port* and
+    every datagram sent to the group is received by all
+    the agents listening on it, including the ones running
+    in other processes of the same computer when the
+    *interface* is the loopback (default).
+    The messages are the ones of XBeeNetwork (see
+    BroadcastNetwork), sent as datagrams that start with
+    the ID of the sender and a newline, so that each agent
+    can ignore its own datagrams when they are looped back.
+    If *period* is given, messages are only sent at the time
+    slots specified by *window_start*, *window_end*, and
+    *period*, exactly as in XBeeNetwork. If not, every
+    message is sent as soon as it is produced.
+    The incoming datagrams are read in batches of up to
+    *batch* messages each time the socket is ready, so that
+    the cost of waking up the read thread is shared by
+    all the messages received in the meantime.
+    See BroadcastNetwork for *inbox_size* and *outbox_size*.
+    """
+    def __init__(self, ID=None, group='239.255.42.42', port=4242,
+                 window_start=None, window_end=None, period=None,
+                 interface='127.0.0.1', ttl=1, batch=64,
+                 inbox_size=64, outbox_size=16):
+        BroadcastNetwork.__init__(self, ID, window_start, window_end, period,
+                                  inbox_size, outbox_size)
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.ttl = ttl
+        self.batch = batch
+        self.send_socket = None
+        self.read_socket = None
+        return
+
+    def start_broadcasting(self):
+        """Open one socket to send to the multicast
+        group and one socket subscribed to it, then
+        start the thread reading incoming messages
+        and, if time slots are used, the thread
+        sending the messages.
+        This method does nothing if the network is
+        already broadcasting (self.broadcasting=True).
+        """
+        if not self.broadcasting:
+            iface = socket.inet_aton(self.interface)
+
+            send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                        socket.IPPROTO_UDP)
+            send_socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_MULTICAST_TTL, self.ttl)
+            send_socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_MULTICAST_LOOP, 1)
+            send_socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_MULTICAST_IF, iface)
+            send_socket.bind((self.interface, 0))
+
+            read_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                        socket.IPPROTO_UDP)
+            read_socket.setsockopt(socket.SOL_SOCKET,
+                                   socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                read_socket.setsockopt(socket.SOL_SOCKET,
+                                       socket.SO_REUSEPORT, 1)
+            read_socket.bind(('', self.port))
+            membership = socket.inet_aton(self.group) + iface
+            read_socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_ADD_MEMBERSHIP, membership)
+            read_socket.setblocking(0)
+
+            self.send_socket = send_socket
+            self.read_socket = read_socket
+            self.broadcasting = True
+            if self.period is not None:
+                self.send_thread = threading.Thread(
+                    target=self.send_background)
+                self.send_thread.daemon = True
+                self.send_thread.start()
+            self.read_thread = threading.Thread(target=self.read_background)
+            self.read_thread.daemon = True
+            self.read_thread.start()
+        return self.send_socket
+
+    def stop_broadcasting(self):
+        """Stop the send and read threads and close
+        the sockets. This function returns when the
+        threads have been succesfully terminated or else
+        raises and Exception.
+        This method does nothing if the network is
+        not broadcasting already (self.broadcasting=False).
+        Returns the number of messages left to send.
+        """
+        if self.broadcasting:
+            self.broadcasting = False
+            self.awake.set()  # force wakeup to finish the threads
+            threads = [self.read_thread]
+            if self.period is not None:
+                threads.append(self.send_thread)
+            for thread in threads:
+                if thread.is_alive():
+                    thread.join(5)
+            if any(thread.is_alive() for thread in threads):
+                raise Exception(
+                    "stop_broadcasting: Could not stop background threads")
+            self.send_socket.close()
+            self.read_socket.close()
+        return self.outbox.qsize()
+
+# User should not need to call any function below this point
+
+    def write(self, message):
+        """Send *message* to the multicast group,
+        preceded by the ID of this agent.
+        """
+        self.send_socket.sendto(self.ID + "\n" + message,
+                                (self.group, self.port))
+        return
+
+    def read(self):
+        """Drain up to *batch* datagrams from the socket
+        without blocking and parse each of them (see
+        BroadcastNetwork.parse). Datagrams sent by this
+        same agent (looped back) are ignored.
+        Returns the number of messages received.
+        """
+        received = 0
+        while received < self.batch:
+            try:
+                message = self.read_socket.recv(65535)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            received += 1
+            sender, _, message = message.partition("\n")
+            if sender != self.ID:
+                self.parse(message)
+        return received
+
+    def read_background(self):
+        """Function meant to be called in a separate
+        thread to wait for incoming datagrams and
+        read them in batches as they arrive.
+        """
+        while self.broadcasting:
+            ready, _, _ = select.select([self.read_socket], [], [], 0.1)
+            if ready:
+                self.read()
+        return
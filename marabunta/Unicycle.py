@@ -0,0 +1,170 @@
+import numpy as np
+
+
+class UnicycleIntegrator(object):
+    """Move many simulated bodies (MockBody) at once,
+    integrating the motion of all of them with numpy
+    on arrays of positions, headings and wheel speeds.
+    The state is read from the bodies and written back
+    on every step, so the bodies remain the reference
+    (e.g. for checkpoints or collisions).
+    Once a body is tracked, its movement methods only
+    store the command of the tick instead of moving it:
+    move_forward(dt, v) sets the linear velocity, move(dt,
+    v, omega) both velocities and rotate(dtheta) a turn
+    to be done during the tick (the last one requested
+    replaces the previous ones, as align() computes it
+    from the current heading). Then step(dt) moves every
+    body along the exact arc of circle given by its
+    command, so that the robots turn while they advance
+    instead of pivoting in place, and large time steps
+    stay accurate.
+    A command lasting less than the tick (e.g. the last
+    move of a navigation, stopping at the waypoint) is
+    spread over the whole tick with its velocities
+    scaled by *duration* / *dt*, so the body covers the
+    same arc. Commands longer than a tick only last
+    one tick.
+    Note that align() (through rotate) no longer turns
+    the body immediately: any sensing done between the
+    align() and the end of the tick, such as the
+    obstacle_infront() check of BaseRobot.move_forward,
+    still sees the heading before the turn.
+    As in MockBody, the velocities are scaled down when
+    a wheel would exceed the *max_speed* of the body, and
+    if *max_accel* is given the speed of the wheels
+    changes at most *max_accel* per second, in which
+    case each step is integrated in *substeps* steps.
+    The commands are cleared after each step, so a body
+    that receives no command in a tick stops.
+    """
+    # Arrays with one item per body: {name: initial value}
+    columns = {"wheel_distance": 0., "max_speed": 0., "v": 0.,
+               "omega": 0., "turn": 0., "duration": np.inf}
+
+    def __init__(self, bodies=(), substeps=1, max_accel=None):
+        self.substeps = max(1, int(substeps))
+        self.max_accel = max_accel
+        self.bodies = []
+        self.index = {}
+        self.buffers = {}
+        bodies = list(bodies)
+        self.reserve(len(bodies))
+        for body in bodies:
+            self.track(body)
+        return
+
+    def track(self, body):
+        """Move *body* with this integrator from now on.
+        The commands already given to the other bodies
+        are kept.
+        """
+        if body not in self.index:
+            k = len(self.bodies)
+            if k == len(self.buffers["v"]):
+                self.reserve(2 * k or 1)
+            self.index[body] = k
+            self.bodies.append(body)
+            body.integrator = self
+            self.buffers["wheel_distance"][k] = body.LRdist
+            self.buffers["max_speed"][k] = body.max_speed
+            self.select()
+        return
+
+    def command(self, body, v=None, omega=None, dtheta=None,
+                duration=None):
+        """Set the linear velocity *v*, the angular
+        velocity *omega* and/or the turn *dtheta* of
+        *body* for the next step. If *duration* is given,
+        the velocities only last that long.
+        """
+        k = self.index[body]
+        if v is not None:
+            self.v[k] = v
+            self.duration[k] = np.inf if duration is None else duration
+        if omega is not None:
+            self.omega[k] = omega
+        if dtheta is not None:
+            self.turn[k] = dtheta
+        return
+
+    def step(self, dt):
+        """Move every body during *dt* following the
+        commands received since the last step.
+        """
+        bodies = self.bodies
+        if not bodies:
+            return
+        x = np.array([body.pos[0] for body in bodies], dtype=float)
+        y = np.array([body.pos[1] for body in bodies], dtype=float)
+        heading = np.array([body.heading for body in bodies], dtype=float)
+        wheels = np.array([body.wheels for body in bodies], dtype=float)
+        fraction = np.clip(self.duration / dt, 0., 1.)
+        v, omega = self.wheel_limits(self.v * fraction,
+                                     self.omega * fraction + self.turn / dt)
+        half_width = 0.5 * self.wheel_distance
+        left = v - omega * half_width
+        right = v + omega * half_width
+        if self.max_accel is None:
+            steps, h = 1, dt
+            wheels[:, 0] = left
+            wheels[:, 1] = right
+        else:
+            steps, h = self.substeps, float(dt) / self.substeps
+            dv = self.max_accel * h
+        for step in range(steps):
+            if self.max_accel is not None:
+                wheels[:, 0] += np.clip(left - wheels[:, 0], -dv, dv)
+                wheels[:, 1] += np.clip(right - wheels[:, 1], -dv, dv)
+            speed = 0.5 * (wheels[:, 0] + wheels[:, 1])
+            half = (0.5 * h * (wheels[:, 1] - wheels[:, 0]) /
+                    self.wheel_distance)
+            chord = speed * h * np.sinc(half / np.pi)
+            x += chord * np.cos(heading + half)
+            y += chord * np.sin(heading + half)
+            heading += 2. * half
+        for k, body in enumerate(bodies):
+            body.pos[0] = float(x[k])
+            body.pos[1] = float(y[k])
+            body.heading = float(heading[k])
+            body.wheels = [float(wheels[k, 0]), float(wheels[k, 1])]
+        self.v[:] = 0.
+        self.omega[:] = 0.
+        self.turn[:] = 0.
+        self.duration[:] = np.inf
+        return
+
+# User should not need to call any function below this point
+
+    def reserve(self, capacity):
+        """Grow the arrays with the parameters and
+        commands of the bodies to hold *capacity*
+        bodies, keeping their contents.
+        """
+        for name, value in self.columns.items():
+            old = self.buffers.get(name)
+            if old is not None and len(old) >= capacity:
+                continue
+            new = np.zeros(capacity) + value
+            if old is not None:
+                new[:len(old)] = old
+            self.buffers[name] = new
+        self.select()
+        return
+
+    def select(self):
+        """Point self.v, self.omega... to the part
+        of the arrays used by the bodies tracked.
+        """
+        n = len(self.bodies)
+        for name in self.columns:
+            setattr(self, name, self.buffers[name][:n])
+        return
+
+    def wheel_limits(self, v, omega):
+        """Return the velocities (v, omega) scaled down
+        so that no wheel goes faster than max_speed.
+        """
+        fastest = np.abs(v) + 0.5 * np.abs(omega) * self.wheel_distance
+        scale = np.minimum(1., self.max_speed / np.maximum(fastest, 1e-12))
+        return v * scale, omega * scale
@@ -1,15 +1,13 @@
-from random import randint
 from time import time, sleep
 import threading
-import Queue
 import glob
-import sys
-from BaseRobot import BaseNetwork
+from BroadcastNetwork import BroadcastNetwork
+from AgentTable import AgentTable
 from utils import SafeSerial
 from serial import Serial
 
 
-class XBeeNetwork(BaseNetwork):
+class XBeeNetwork(BroadcastNetwork):
     """Network class for communication using XBee series 1
     connected as a serial port in /dev/ttyUSB*.
     Messages are only sent at particular time slots specified
@@ -17,38 +15,19 @@ class XBeeNetwork(BaseNetwork):
     The incoming data in the serial port is continually
     scanned for new messages.
     When receiving a message, its content is assumed to have
-    a certain structure defined by the first two characters.
+    a certain structure defined by the first two characters
+    (see BroadcastNetwork, which also describes
+    *inbox_size* and *outbox_size*).
     """
     def __init__(self, window_start, window_end, period,
-                 ID=None, lock=None, tty='/dev/ttyUSB*'):
+                 ID=None, lock=None, tty='/dev/ttyUSB*',
+                 inbox_size=64, outbox_size=16):
         assert period > 0.
-        assert window_start >= 0. and window_start < period
-        assert window_end > window_start and window_end <= period
-        self.window_start = window_start
-        self.window_end = window_end
-        self.period = period
-        if ID:
-            self.ID = str(ID)
-        else:
-            self.ID = str(randint(0, 999999))
+        BroadcastNetwork.__init__(self, ID, window_start, window_end, period,
+                                  inbox_size, outbox_size)
         self.lock = lock
         self.tty = tty
-        self.broadcasting = False
         self.port = None
-        self.poses = {}
-        self.obstacles = {}
-        self.obstimes = {}
-        self.inbox = Queue.LifoQueue()
-        self.outbox = Queue.LifoQueue()
-        self.awake = threading.Event()
-        self.awake.set()
-        self.parser = {"xx": self.parse_state,
-                       "tt": self.parse_heading,
-                       "oo": self.parse_obstacles,
-                       "xo": self.parse_state_obstacles,
-                       "up": self.parse_wakeup,
-                       "ss": self.parse_sleep,
-                       "mm": self.parse_message}
         return
 
     def start_broadcasting(self):
@@ -118,14 +97,6 @@ class XBeeNetwork(BaseNetwork):
             self.port.close()
         return self.outbox.qsize()
 
-    def __enter__(self):
-        self.start_broadcasting()
-        return self
-
-    def __exit__(self, type, value, traceback):
-        self.stop_broadcasting()
-        return
-
     def standby(self):
         """If the robot is asleep, check periodically
         for a wakeup signal (signal starting with "up").
@@ -141,143 +112,8 @@ class XBeeNetwork(BaseNetwork):
                     self.parse_wakeup("")
         return time() - init_time
 
-    def is_awake(self):
-        return self.awake.is_set()
-
-# Sending methods:
-
-    def send_state(self, pos, heading):
-        """Send string of the form:
-                "xx*x*  *y*   *heading* *time*    *ID*"
-        This is a low priority message, it is only scheduled
-        to send if there is no other message in the stack.
-        """
-        message = "xx{:.5f}\t{:.5f}\t{:.5f}\t{:.5f}\t{:}\n".format(
-            pos[0], pos[1], heading, time(), self.ID)
-        if self.outbox.empty():
-            self.outbox.put(message)
-        return message
-
-    def send_heading(self, heading):
-        """Send string of the form:
-                "tt*heading*    *time*    *ID*"
-        This is a low priority message, it is only scheduled
-        to send if there is no other message in the stack.
-        """
-        message = "tt{:.5f}\t{:.5f}\t%{:}\n".format(heading, time(), self.ID)
-        if self.outbox.empty():
-            self.outbox.put(message)
-        return message
-
-    def send_obstacles(self, obstacles):
-        """Send string of the form:
-                "oo*x1*:*y1*    *x2*:*y2* (...) *time* *ID*"
-        The message can contain an arbitrary number of obstacles
-        (but it is not guaranteed to be sent correctly if there
-        are too many).
-        """
-        obstacles_str = "".join("{:.2f}:{:.2f}".format(*o) for o in obstacles)
-        message = "oo{:}{:.5f}\t{:}".format(obstacles_str, time(), self.ID)
-        self.outbox.put(message)
-        return message
-
-    def send_state_obstacles(self, pos, heading, obstacles):
-        """Send string of the form:
-            "xo*x*  *y*   *heading* *x1*:*y1*    *x2*:*y2* (...) *time* *ID*"
-        The message can contain an arbitrary number of obstacles
-        (but it is not guaranteed to be sent correctly if there
-        are too many).
-        """
-        obstacles_str = "".join("{:.2f}:{:.2f}".format(*o) for o in obstacles)
-        message = "xo{:.5f}\t{:.5f}\t{:.5f}\t{:}\t{:.5f}\t{:}\n".format(
-            pos[0], pos[1], heading, obstacles_str, time(), self.ID)
-        if self.outbox.empty():
-            self.outbox.put(message)
-        return message
-
-    def send_wakeup(self):
-        """Send wakeup signal to everyone.
-        Message includes the ID and the time.
-        """
-        message = "up{:.5f}\t{:}\n".format(time(), self.ID)
-        self.outbox.put(message)
-        return message
-
-    def send_sleep(self):
-        """Send sleep signal to everyone.
-        Message includes the ID and the time.
-        """
-        message = "ss{:.5f}\t{:}\n".format(time(), self.ID)
-        self.outbox.put(message)
-        return message
-
-    def send_message(self, text):
-        """Sends a generic message given
-        as input.
-        """
-        message = "mm" + str(text)
-        self.outbox.put(message)
-        return message
-
 # Processing incoming methods:
 
-    def parse_state(self, message):
-        """Parse a message containing x, y, theta, time, ID"""
-        try:
-            x, y, theta, time, ID = message.rstrip('\n').split()
-            self.poses[ID] = (float(x), float(y), float(theta))
-        except:
-            sys.stderr.write("parse_state(): Bad data:\n" + message + "\n")
-        return
-
-    def parse_heading(self, message):
-        """Parse a message containing theta, time, ID"""
-        try:
-            theta, time, ID = message.rstrip('\n').split()
-            self.poses[ID] = float(theta)
-        except:
-            sys.stderr.write("parse_heading(): Bad data:\n" + message + "\n")
-        return
-
-    def parse_obstacles(self, message):
-        """Parse a message containing a set of obstacle
-        coordinates. Not implemented yet.
-        """
-        try:
-            data = message.rstrip('\n').split()
-            ID = data.pop()
-            time = float(data.pop())
-            self.obstacles[ID] = [[float(p) for p in point.split(':')]
-                                  for point in data]
-            self.obstimes[ID] = time
-        except:
-            sys.stderr.write("parse_obstacles(): Bad data:\n" + message + "\n")
-        return
-
-    def parse_state_obstacles(self, message):
-        """Parse a message containing x, y, theta and
-        a set of obstacle coordinates.
-        Not implemented yet.
-        """
-        try:
-            data = message.rstrip('\n').split()
-            ID = data.pop()
-            time = float(data.pop())
-            x, y, theta = data[:3]
-            self.poses[ID] = (float(x), float(y), float(theta))
-            self.obstacles[ID] = [[float(p) for p in point.split(':')]
-                                  for point in data]
-            self.obstimes[ID] = time
-        except:
-            sys.stderr.write(
-                "parse_state_obstacles(): Bad data:\n" + message + "\n")
-        return
-
-    def parse_wakeup(self, message):
-        """Wakes up the device."""
-        self.awake.set()
-        return
-
     def parse_sleep(self, message):
         """If device is awake, set to sleep and
         put on standby mode. This method returns
@@ -288,98 +124,28 @@ class XBeeNetwork(BaseNetwork):
             self.standby()
         return
 
-    def parse_message(self, message):
-        self.inbox.put(message)
-        return
-
-    def get_messages(self):
-        """Returns all incoming messages received since
-        last call to this method. The messages are
-        returned in a list sorted from newest to oldest
-        (FILO stack).
-        """
-        incomings = []
-        while not self.inbox.empty():
-            incomings.append(self.inbox.get())
-            self.inbox.task_done()
-        return incomings
-
-    def get_agents_state(self):
-        """Returns the dictionary with the
-        data gathered from the network through the
-        read_background thread regarding the
-        state (position and heading) of the agents.
-        """
-        return self.poses
-
-    def get_obstacles(self):
-        """Returns the dictionary with the
-        data gathered from the network through the
-        read_background thread regarding the
-        obstacles detected by other agents.
-        """
-        return self.obstacles, self.obstimes
-
 
 # User should not need to call any function below this point
 
-    def send(self):
-        """Write the most recent item put into
-        the outbox into the serial port.
-        Return the item.
-        """
-        m = self.outbox.get()
-        self.port.write(m)
-        self.outbox.task_done()
-        return m
-
-    def send_background(self):
-        """Function meant to be called in a separate
-        thread to continuosly check for the time and
-        send the most recent message whenever the
-        time slot is right.
-        When the proper time slot is reached, this
-        sends the last item put in the Queue.
-        and erases the rest.
-        """
-        while self.broadcasting:
-            t = time() % self.period
-            if t < self.window_start:
-                sleep(self.window_start - t)
-            elif t >= self.window_end:
-                sleep(self.period + self.window_start - t)
-            else:
-                if self.outbox.empty():
-                    sleep((self.window_end - self.window_start) * 0.2)
-                else:
-                    self.send()
-                    # make sure only one message per window is sent:
-                    sleep(self.window_end - time() % self.period)
-            self.awake.wait()  # wait until the device is awake.
+    def write(self, message):
+        """Write *message* into the serial port."""
+        self.port.write(message)
         return
 
     def read(self):
         """If there is an incoming message wait until
-        a whole line is receive, then parse using
-        the appropiate parser function according to
-        the "key" of the message (first two characters).
+        a whole line is receive, then parse it (see
+        BroadcastNetwork.parse).
         A certain structure for the message is assumed,
         if the message fails to follow the structure a
         warning is sent to stderr and the message is
         ignored.
-        New keys should be added to the keys-to-parsers
-        dict, self.parser.
         Returns the received message.
         """
         message = ''
         if self.port.inWaiting() > 0:
             message = self.port.readline()
-            if len(message) > 1:
-                key = message[0:2]
-                try:
-                    self.parser[key](message[2:])
-                except KeyError:
-                    sys.stderr.write("read(): unknown key:\n" + key + "\n")
+            self.parse(message)
         return message
 
     def read_background(self):
@@ -402,30 +168,12 @@ class XBeeExpirationNetwork(XBeeNetwork):
     received is ignored after *expiration_time*
     number of seconds since it was first sent
     (according to the sender).
+    The expired agents are evicted from the table
+    of states when calling get_agents_state().
     """
     def __init__(self, expiration_time, window_start, window_end,
                  period=1, ID=None, lock=None):
         self.expiration_time = expiration_time
-        self.expirations = {}
         XBeeNetwork.__init__(self, window_start, window_end, period, ID, lock)
+        self.poses = AgentTable(expiration_time)
         return
-
-    def parse_state(self, message):
-        """Parse a message containing x, y, theta, time, ID.
-        Store the expiration date of the message in self.expirations."""
-        try:
-            x, y, theta, time, ID = message.rstrip('\n').split()
-            self.poses[ID] = (float(x), float(y), float(theta))
-            self.expirations[ID] = float(time) + self.expiration_time
-        except:
-            sys.stderr.write("parse_state(): Bad data:\n" + message + "\n")
-        return
-
-    def get_agents_state(self):
-        """Build a new dictionary that only contains the entries from
-        self.poses that have not yet reached their expiration time.
-        """
-        t = time()
-        ids = [ID for ID, exp_time in self.expirations.items() if t < exp_time]
-        g = {ID: self.poses[ID] for ID in ids}
-        return g
@@ -1,12 +1,25 @@
 from BaseRobot import BaseRobot, BaseBody, BaseNetwork
 from MockBody import MockBody
-from MockNetwork import MockNetwork
-from Map import Map2D
+from MockNetwork import MockNetwork, MockRingNetwork
+from BroadcastNetwork import BroadcastNetwork
+from UDPNetwork import UDPNetwork
+from Map import Map2D, CompactMap2D, SparseMap2D, RobotMap
+from Planner import GridPlanner
+from AgentTable import AgentTable
+from ProcessSwarm import ProcessSwarm
+from SwarmExecutor import SwarmExecutor
+from SwarmMetrics import SwarmMetrics
+from Checkpoint import save_checkpoint, load_checkpoint
+from Scenario import Scenario
 import imp
 
 __all__ = ['BaseRobot', 'BaseBody', 'BaseNetwork',
-           'MockBody', 'MockNetwork',
-           'Map2D']
+           'MockBody', 'MockNetwork', 'MockRingNetwork',
+           'BroadcastNetwork', 'UDPNetwork',
+           'Map2D', 'CompactMap2D', 'SparseMap2D', 'RobotMap', 'GridPlanner',
+           'AgentTable',
+           'ProcessSwarm', 'SwarmExecutor', 'SwarmMetrics',
+           'save_checkpoint', 'load_checkpoint', 'Scenario']
 
 # Include eBotBody only if eBot-API is installed
 try:
@@ -31,3 +44,28 @@ if include_serial:
     from XBeeNetwork import XBeeNetwork, XBeeExpirationNetwork
     __all__.extend(['XBeeNetwork', 'XBeeExpirationNetwork'])
 del include_serial
+
+# Include CollisionSolver and UnicycleIntegrator only if numpy is installed
+try:
+    imp.find_module('numpy')
+    include_numpy = True
+except ImportError:
+    include_numpy = False
+
+if include_numpy:
+    from Collisions import CollisionSolver
+    from Unicycle import UnicycleIntegrator
+    __all__.extend(['CollisionSolver', 'UnicycleIntegrator'])
+del include_numpy
+
+# Include Renderer only if matplotlib is installed
+try:
+    imp.find_module('matplotlib')
+    include_matplotlib = True
+except ImportError:
+    include_matplotlib = False
+
+if include_matplotlib:
+    from Renderer import Renderer, RenderProcess
+    __all__.extend(['Renderer', 'RenderProcess'])
+del include_matplotlib
@@ -0,0 +1,47 @@
+"""Run simulations described in scenario files
+(see marabunta.Scenario) without writing any code:
+
+    python -m marabunta scenario1.json [scenario2.json ...]
+
+Each scenario is run headless as fast as possible, one
+after the other, and a summary of its metrics is printed
+as a line of JSON.
+"""
+import argparse
+import json
+import sys
+from time import time
+from marabunta.Scenario import Scenario
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m marabunta",
+        description="Run marabunta simulations from scenario files.")
+    parser.add_argument("scenarios", nargs="+", metavar="scenario",
+                        help="JSON (or YAML) scenario file")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the checkpoint, if any")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="override the seed of every scenario")
+    args = parser.parse_args(argv)
+    failed = 0
+    for filename in args.scenarios:
+        start = time()
+        try:
+            scenario = Scenario.from_file(filename)
+            if args.seed is not None:
+                scenario.data["seed"] = args.seed
+            summary = scenario.run(resume=args.resume)
+        except Exception as e:
+            failed += 1
+            sys.stderr.write("%s: %s\n" % (filename, e))
+            continue
+        summary["scenario"] = filename
+        summary["wall_time"] = time() - start
+        print(json.dumps(summary, sort_keys=True))
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
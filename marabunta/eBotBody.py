@@ -4,7 +4,7 @@ from BaseRobot import BaseBody
 import threading
 from time import time, sleep
 import sys
-from utils import clean_angle
+from utils import clean_angle, monotonic
 
 
 class eBotBody(BaseBody, eBot.eBot):
@@ -18,6 +18,10 @@ class eBotBody(BaseBody, eBot.eBot):
     The background movement is started when the body is turned on, but it can
     be stopped at any point and the class is still completely usable without
     this background thread.
+    If *control_rate* (in Hz) is given, the background thread runs its loop
+    at that rate, scheduling each iteration against a monotonic clock instead
+    of sleeping a fixed time after each one. The rate and jitter achieved are
+    stored in *self.control_stats*.
 
     This class assumes the eBot-API provides a position() method that
     returns (x, y, theta) with x, y in meters and theta in degrees between 0
@@ -25,7 +29,8 @@ class eBotBody(BaseBody, eBot.eBot):
     ultrasound sensors.
     """
     def __init__(self, pos, heading,
-                 lock=None, max_speed=0.15, LRdist=0.10, aperture=0.7854):
+                 lock=None, max_speed=0.15, LRdist=0.10, aperture=0.7854,
+                 control_rate=None):
         # State (in robot coordinates)
         self.pos = [pos[0], pos[1]]
         self.heading = heading
@@ -38,6 +43,8 @@ class eBotBody(BaseBody, eBot.eBot):
         self.control_Kp = 3.
         self.control_Ti = 11.
         self.control_Td = 0.01
+        self.control_rate = control_rate
+        self.control_stats = {"rate": 0., "jitter": 0., "overruns": 0}
 
         self.awake = threading.Event()
         self.aligned = threading.Event()
@@ -90,9 +97,10 @@ class eBotBody(BaseBody, eBot.eBot):
         return
 
     def turn_off(self):
-        """Stop the background movement and
-        disconnect using the API method.
+        """Stop the command queue and the background
+        movement and disconnect using the API method.
         """
+        self.stop_commands()
         self.stop_move_background()
         self.halt()  # from eBot.eBot
         self.disconnect()  # from eBot.eBot
@@ -197,6 +205,18 @@ class eBotBody(BaseBody, eBot.eBot):
         the robot should stop after *dt* or keep
         the current speed.
         """
+        self.set_wheels(v, omega)
+        sleep(dt)
+        if stop_flag:
+            self.wheels(0, 0)
+        return
+
+    def set_wheels(self, v, omega):
+        """Set the wheel speeds to move with linear
+        velocity v and angular velocity omega, giving
+        priority to omega (see move) and return
+        immediately.
+        """
         vrot = 0.5 * omega * self.LRdist
         if vrot > self.max_speed:
             vrot = self.max_speed
@@ -208,9 +228,30 @@ class eBotBody(BaseBody, eBot.eBot):
         left_wheel = self.wheel_speed(v - vrot)
         right_wheel = self.wheel_speed(v + vrot)
         self.wheels(left_wheel, right_wheel)
-        sleep(dt)
-        if stop_flag:
-            self.wheels(0, 0)
+        return left_wheel, right_wheel
+
+    def execute(self, command):
+        """Perform a command submitted through submit().
+        If the background move is activated, set its
+        targets and wait for *duration* seconds (or until
+        the command is cancelled). The robot is stopped
+        afterwards unless more commands are waiting.
+        If not, use the blocking movement methods.
+        """
+        if not self.moving_background:
+            return BaseBody.execute(self, command)
+        if command.heading is not None:
+            self.target_heading = command.heading
+        if command.v is not None:
+            self.target_speed = command.v
+        self.target_omega = command.omega or None
+        end_time = time() + command.duration
+        while not command.cancelled and time() < end_time:
+            sleep(min(0.02, max(0., end_time - time())))
+        if command.cancelled or self.commands.empty():
+            self.target_omega = None
+            self.target_heading = self.get_heading()
+            self.target_speed = 0.
         return
 
     def move_background(self):
@@ -218,7 +259,11 @@ class eBotBody(BaseBody, eBot.eBot):
         to self.target_heading while
         cruising at self.target_speed if possible.
         Uses PID to align.
+        If self.control_rate is set, use
+        move_background_fixed_rate instead.
         """
+        if self.control_rate:
+            return self.move_background_fixed_rate()
         dt = 0.1
         dtheta = 0.0
         time_now = time()
@@ -233,29 +278,101 @@ class eBotBody(BaseBody, eBot.eBot):
                 # Update new values
                 dtheta = clean_angle(self.target_heading - self.get_heading())
                 time_now = time()
-
-                if abs(dtheta) > 0.1:
-                    self.aligned.clear()
-                else:
-                    self.aligned.set()
-
-                # Proportional
-                omega = self.control_Kp * dtheta
-                # Integral
-                real_dt = time_now - old_time
-                if self.control_Ti:
-                    errorint += real_dt * dtheta
-                    omega += (self.control_Kp * errorint) / self.control_Ti
-                # Differential
-                if self.control_Td:
-                    derrordt = clean_angle(dtheta - old_dtheta) / real_dt
-                    omega += self.control_Kp * self.control_Td * derrordt
+                omega, errorint = self.pid_omega(dtheta, old_dtheta,
+                                                 time_now - old_time,
+                                                 errorint)
 
             self.move(dt, self.target_speed, omega, stop_flag=False)  # sleeps
             self.awake.wait()
         self.halt()
         return
 
+    def move_background_fixed_rate(self):
+        """Same as move_background but running the
+        loop at self.control_rate iterations per second.
+        Each iteration is scheduled against a deadline
+        in a monotonic clock, so the time spent reading
+        the state and setting the wheels does not add
+        up to the period. The time between samples used
+        by the PID is measured with the same clock.
+        If an iteration overruns its deadline, the
+        schedule restarts from the current time instead
+        of trying to catch up.
+        The achieved rate and the jitter (mean absolute
+        deviation of the period) are kept up to date in
+        self.control_stats as moving averages.
+        """
+        period = 1. / self.control_rate
+        alpha = 0.05  # weight of each new sample in the averages
+        mean_period = period
+        jitter = 0.
+        overruns = 0
+        dtheta = 0.0
+        errorint = 0.
+        time_now = monotonic()
+        deadline = time_now
+        while self.moving_background:
+            self.update_state()
+            old_time = time_now
+            time_now = monotonic()
+            real_dt = time_now - old_time
+            omega = self.target_omega
+            if omega is None:
+                old_dtheta = dtheta
+                dtheta = clean_angle(self.target_heading - self.get_heading())
+                omega, errorint = self.pid_omega(dtheta, old_dtheta, real_dt,
+                                                 errorint)
+
+            self.set_wheels(self.target_speed, omega)
+
+            # Statistics of the loop
+            if real_dt > 0.:
+                mean_period += alpha * (real_dt - mean_period)
+                jitter += alpha * (abs(real_dt - period) - jitter)
+                self.control_stats = {"rate": 1. / mean_period,
+                                      "jitter": jitter,
+                                      "overruns": overruns}
+
+            deadline += period
+            delay = deadline - monotonic()
+            if delay > 0.:
+                sleep(delay)
+            else:
+                overruns += 1
+                deadline = monotonic()
+            if not self.awake.is_set():
+                self.awake.wait()
+                time_now = deadline = monotonic()  # do not count sleep
+        self.halt()
+        return
+
+    def pid_omega(self, dtheta, old_dtheta, real_dt, errorint):
+        """One update of the PID used by the background
+        move to align the robot: *dtheta* is the current
+        heading error, *old_dtheta* the previous one,
+        *real_dt* the time between both samples and
+        *errorint* the integral of the error so far.
+        Also sets or clears self.aligned.
+        Returns the angular velocity and the updated
+        integral of the error.
+        """
+        if abs(dtheta) > 0.1:
+            self.aligned.clear()
+        else:
+            self.aligned.set()
+        # Proportional
+        omega = self.control_Kp * dtheta
+        if real_dt > 0.:
+            # Integral
+            if self.control_Ti:
+                errorint += real_dt * dtheta
+                omega += (self.control_Kp * errorint) / self.control_Ti
+            # Differential
+            if self.control_Td:
+                derrordt = clean_angle(dtheta - old_dtheta) / real_dt
+                omega += self.control_Kp * self.control_Td * derrordt
+        return omega, errorint
+
 # Sensors
 
     def light_detected(self):
@@ -31,23 +31,25 @@ class AreaCoverageRobot(PerimeterDefenseRobot):
         still taking all into account and
         allowing for neighbors to "cancel each
         other out."
+        The obstacles push the robot away in
+        the same way, which is obtained from
+        body.obstacle_repulsion().
         Returns a vector pointing to the
-        mean heading. If no agents are
-        detected, returns None.
+        mean heading. If no agents or obstacles
+        are detected, returns None.
         """
-        neis = self.get_agents().values()
+        neis = self.get_neighbors(self.neighbor_radius).values()
         pos = self.body.get_position()
-        # Get both neighbors and obstacles, in relative coordinates
-        points = [ [nei[0]-pos[0], nei[1]-pos[1]] for nei in neis] + self.body.obstacle_coordinates()
-        if points:
-            target = [0.,0.]
-            for p in points:
-                d2 = p[0]**2 + p[1]**2
+        target = self.body.obstacle_repulsion()
+        # Neighbors in relative coordinates
+        points = [ [nei[0]-pos[0], nei[1]-pos[1]] for nei in neis]
+        for p in points:
+            d2 = p[0]**2 + p[1]**2
+            if d2>0:
                 weight = (1.0/d2 )**1.5
-                if d2>0:
-                    target[0] -= p[0]*weight
-                    target[1] -= p[1]*weight
-        else:
+                target[0] -= p[0]*weight
+                target[1] -= p[1]*weight
+        if not points and target[0]==0. and target[1]==0.:
             target= None
         return target
 
@@ -10,6 +10,8 @@ class HeadingConsensusRobot(BaseRobot):
     Obstacle avoidance (implemented in BaseRobot)
     will take precence over consensus reaching.
     """
+    # The cached heading is only valid for the current network table
+    transient_attributes = BaseRobot.transient_attributes + ("heading_cache",)
 
     #def __init__(self, body, network):
     #    BaseRobot.__init__(self, body, network)
@@ -26,14 +28,24 @@ class HeadingConsensusRobot(BaseRobot):
         Returns a vector pointing to the
         mean heading. If no agents are
         detected, returns None.
+        The result is reused while the
+        network has not received new data.
         """
-        neis = self.get_agents().values()
-        if neis:
-            sint = sum( [sin(nei[2]) for nei in neis])
-            cost = sum( [cos(nei[2]) for nei in neis])
-            target = [cost, sint]
+        agents = self.get_agents()
+        cache = getattr(self, "heading_cache", (None, None))
+        if agents.version is not None and agents.version == cache[0]:
+            target = cache[1]
         else:
-            target = None
+            neis = agents.values()
+            if neis:
+                sint = sum( [sin(nei[2]) for nei in neis])
+                cost = sum( [cos(nei[2]) for nei in neis])
+                target = [cost, sint]
+            else:
+                target = None
+            self.heading_cache = (agents.version, target)
+        if target:
+            target = target[:]  # correct_target modifies it
         return target
 
     def move_to_target(self, target, deltat, v):
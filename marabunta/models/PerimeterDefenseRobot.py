@@ -12,14 +12,21 @@ class PerimeterDefenseRobot(BaseRobot):
     set to 0.
     Obstacle avoidance (implemented in BaseRobot)
     will take precence over consensus reaching.
+    If *neighbor_radius* is given, only the robots
+    closer than that are taken into account.
+    If a *planner* (GridPlanner) is set, rendezvous
+    points are reached following the path it gives
+    around the obstacles.
     """
-    def __init__(self, body, network, threshold):
+    def __init__(self, body, network, threshold, neighbor_radius=None):
         BaseRobot.__init__(self, body, network)
         self.threshold = threshold
+        self.neighbor_radius = neighbor_radius
         self.rendezvous_point = None
         self.path = []
         self.known_lights = []
         self.num_lights = 0
+        self.planner = None
         return
 
     
@@ -27,6 +34,31 @@ class PerimeterDefenseRobot(BaseRobot):
         self.path = path[:]
         return self.path
 
+    def set_planner(self, planner):
+        """Use *planner* to reach the rendezvous
+        points. Many robots can share the same
+        planner so that paths to the same point
+        are only computed once.
+        """
+        self.planner = planner
+        return self.planner
+
+    def set_rendezvous(self, point):
+        """Set *point* as the rendezvous point. If there
+        is a planner, the path to it is stored in
+        self.path and its first waypoint is set as the
+        current rendezvous point instead.
+        """
+        path = None
+        if self.planner is not None:
+            path = self.planner.plan(self.body.get_position(), point)
+        if path:
+            self.rendezvous_point = path[0]
+            self.path = path[1:]
+        else:
+            self.rendezvous_point = point
+        return self.rendezvous_point
+
     def spread_target(self):
         """Get the other agent's state and
         compute the direction of motion that
@@ -48,7 +80,7 @@ class PerimeterDefenseRobot(BaseRobot):
         mean heading. If no agents are
         detected, returns None.
         """
-        neis = self.get_agents().values()
+        neis = self.get_neighbors(self.neighbor_radius).values()
         pos = self.body.get_position()
         if neis:
             target = [0.,0.]
@@ -138,7 +170,7 @@ class PerimeterDefenseRobot(BaseRobot):
                     raise Exception("Stop!")
                 elif mesdata[0]=="goto":
                     try:
-                        self.rendezvous_point =  (float(mesdata[1]), float(mesdata[2]))
+                        self.set_rendezvous((float(mesdata[1]), float(mesdata[2])))
                     except:
                         print("#PerimenterDefenseRobot: Strange message received: ",message)
                 elif mesdata[0]=="light":
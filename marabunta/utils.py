@@ -1,6 +1,8 @@
 from serial import Serial
 import thread
 import threading
+import collections
+import Queue
 from math import pi
 
 
@@ -53,3 +55,157 @@ class SafeSerial(Serial):
         with self.lock:
             m = super(SafeSerial, self).flushOutput()
         return m
+
+
+def message_key(message):
+    """Return the type of a raw message, i.e.
+    its first two characters ("xx", "mm", ...)
+    """
+    return message[0:2]
+
+
+def message_word(message):
+    """Return the first word of a message,
+    e.g. "goto" for "goto 1.00 2.00".
+    Used to classify the text messages
+    received through "mm".
+    """
+    words = message.split(None, 1)
+    if words:
+        return words[0]
+    return ''
+
+
+class RingQueue(object):
+    """Thread-safe bounded LIFO queue meant to be used
+    as the inbox or outbox of a network.
+    It holds at most *maxsize* items. What happens when
+    a new item arrives depends on the policy associated
+    to its type, given by *kind(item)*:
+        "newest": keep the newest items, i.e. drop the
+                  oldest item in the queue if it is full.
+        "oldest": keep the oldest items, i.e. drop the
+                  new item if the queue is full.
+        "coalesce": replace the item in the queue with
+                  the same *kind(item)*, if any. Else
+                  behave as "newest".
+    The policy for each type is set in the dictionary
+    *policies*. Types not in there use *default_policy*.
+    The number of items dropped and coalesced are stored
+    in self.dropped and self.coalesced.
+    The methods put, get, empty, qsize, and task_done
+    behave as in Queue.LifoQueue so it can be used as
+    a drop-in replacement.
+    """
+    policy_names = ("newest", "oldest", "coalesce")
+
+    def __init__(self, maxsize=32, policies=None, default_policy="newest",
+                 kind=message_key):
+        assert maxsize > 0
+        assert default_policy in self.policy_names
+        self.maxsize = maxsize
+        self.policies = dict(policies or {})
+        assert all(p in self.policy_names for p in self.policies.values())
+        self.default_policy = default_policy
+        self.kind = kind
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.coalesced = 0
+        return
+
+    def put(self, item):
+        """Add *item* to the queue following the
+        policy of its type.
+        Return True if the item was stored.
+        """
+        kind = self.kind(item)
+        policy = self.policies.get(kind, self.default_policy)
+        with self.lock:
+            if policy == "coalesce":
+                for i, old in enumerate(self.items):
+                    if self.kind(old) == kind:
+                        del self.items[i]
+                        self.items.append(item)
+                        self.coalesced += 1
+                        return True
+            if len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if policy == "oldest":
+                    return False
+                self.items.popleft()
+            self.items.append(item)
+        return True
+
+    def get(self):
+        """Remove and return the newest item.
+        Raise Queue.Empty if there are no items.
+        """
+        with self.lock:
+            if not self.items:
+                raise Queue.Empty
+            return self.items.pop()
+
+    def get_all(self):
+        """Remove and return all the items in a list
+        sorted from newest to oldest.
+        """
+        with self.lock:
+            items = list(reversed(self.items))
+            self.items.clear()
+        return items
+
+    def empty(self):
+        return not self.items
+
+    def qsize(self):
+        return len(self.items)
+
+    def task_done(self):
+        return
+
+    def stats(self):
+        """Return a dictionary with the queue counters."""
+        return {"size": len(self.items),
+                "dropped": self.dropped,
+                "coalesced": self.coalesced}
+
+
+def _monotonic_clock():
+    """Return a function giving the time in seconds
+    from a clock that never goes backwards, as
+    time.monotonic in Python 3. Falls back to
+    clock_gettime(CLOCK_MONOTONIC) through ctypes,
+    and to time.time if neither is available.
+    """
+    try:
+        from time import monotonic
+        return monotonic
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long),
+                        ("tv_nsec", ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or
+                            ctypes.util.find_library("c"), use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1  # Linux
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return t.tv_sec + t.tv_nsec * 1.e-9
+        monotonic()
+        return monotonic
+    except (AttributeError, OSError, TypeError):
+        from time import time
+        return time
+
+monotonic = _monotonic_clock()